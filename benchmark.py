@@ -0,0 +1,431 @@
+"""Benchmark the tracking hot path against a local fake web and Telegram.
+
+Serves synthetic pages from an aiohttp server in a child process, stands in
+a recording client for Pyrogram and runs check rounds over every tracked
+subscription, then reports throughput, check latency, peak RSS and bytes
+transferred.
+
+    python benchmark.py --target delete --urls 500 --users 50 --rounds 3
+    python benchmark.py --target bot --urls 2000 --churn 0.2 --json baseline.json
+
+``--target delete`` runs URLTrackerBot.check_updates against mongomock_motor,
+or against a real server with ``--mongo-uri`` (a throwaway database is used
+and dropped). ``--target bot`` runs bot.check_urls on a temporary SQLite file;
+its latency is per URL, since one check serves all of a URL's subscribers.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import contextlib
+import resource
+import tempfile
+import multiprocessing
+from types import SimpleNamespace
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+WORDS = (
+    'notice exam result admit card schedule update form release date session '
+    'merit list answer key syllabus seat allotment round counselling portal '
+    'candidates download official circular revised phase semester fee'
+).split()
+MEDIA_TYPES = ('.pdf', '.jpg', '.mp3', '.mp4')
+
+# ------------------- Fake web ------------------- #
+def paragraph(seed: str, words: int = 80) -> str:
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def build_page(i: int, version: int, opts: Dict) -> bytes:
+    """Deterministic page: churned pages change their first blocks and gain a new media link"""
+    blocks = max(1, opts['page_kb'] * 1024 // 600)
+    body = [f"<h1>Page {i}</h1>"]
+    for p in range(blocks):
+        body.append(f"<p>{paragraph(f'{i}:{p}:{version if p < 2 else 0}')}</p>")
+    body.append('<ul>')
+    for link in range(opts['links']):
+        body.append(f'<li><a href="/page/{(i + link + 1) % opts["urls"]}?from={i}">related {link}</a></li>')
+    for m in range(opts['media']):
+        body.append(f'<li><a href="/media/{i}-{m}{MEDIA_TYPES[m % len(MEDIA_TYPES)]}">file {m}</a></li>')
+    if opts['media'] and version:
+        body.append(f'<li><a href="/media/{i}-v{version}.pdf">new file</a></li>')
+    body.append('</ul>')
+    html = (
+        f"<html><head><title>Page {i}</title><script>var t={version};</script></head>"
+        f"<body><nav>menu</nav><main>{''.join(body)}</main><footer>footer</footer></body></html>"
+    )
+    return html.encode()
+
+def run_server(port: int, opts: Dict):
+    rng = random.Random(opts['seed'])
+    versions = [0] * opts['urls']
+    pages: Dict[int, tuple] = {}
+    stats = {'requests': 0, 'bytes': 0, 'not_modified': 0}
+    blob = random.Random(opts['seed']).randbytes(opts['media_kb'] * 1024)
+
+    @web.middleware
+    async def count(request, handler):
+        response = await handler(request)
+        if not request.path.startswith('/_'):
+            stats['requests'] += 1
+            if request.method != 'HEAD' and response.body is not None:
+                stats['bytes'] += len(response.body)
+        return response
+
+    async def page(request):
+        i = int(request.match_info['i'])
+        if i >= opts['urls']:
+            raise web.HTTPNotFound()
+        etag = f'"{i}-{versions[i]}"'
+        if opts['etag'] and request.headers.get('If-None-Match') == etag:
+            stats['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        cached = pages.get(i)
+        if not cached or cached[0] != versions[i]:
+            cached = pages[i] = (versions[i], build_page(i, versions[i], opts))
+        headers = {'ETag': etag} if opts['etag'] else {}
+        return web.Response(body=cached[1], content_type='text/html', headers=headers)
+
+    async def media(request):
+        name = request.match_info['name']
+        return web.Response(
+            body=name.encode() + blob,
+            content_type='application/octet-stream',
+            headers={'ETag': f'"{name}"'}
+        )
+
+    async def next_round(request):
+        for i in range(opts['urls']):
+            if rng.random() < opts['churn']:
+                versions[i] += 1
+        return web.json_response({'changed': sum(1 for v in versions if v)})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(middlewares=[count])
+    app.router.add_get('/page/{i:\\d+}', page)
+    app.router.add_get('/media/{name}', media)
+    app.router.add_post('/_round', next_round)
+    app.router.add_get('/_stats', get_stats)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def wait_for_server(base_url: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{base_url}/_stats") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+            await asyncio.sleep(0.1)
+
+class FakeWeb:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = aiohttp.ClientSession()
+
+    async def next_round(self):
+        async with self.session.post(f"{self.base_url}/_round") as resp:
+            return await resp.json()
+
+    async def stats(self) -> Dict:
+        async with self.session.get(f"{self.base_url}/_stats") as resp:
+            return await resp.json()
+
+    async def close(self):
+        await self.session.close()
+
+# ------------------- Fake Telegram ------------------- #
+class FakeClient:
+    """Records what the bot would send; media calls return a message carrying a file_id"""
+
+    def __init__(self):
+        self.messages = 0
+        self.media = 0
+        self.uploaded_bytes = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages += 1
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+    async def _send_media(self, kind: str, chat_id, media, **kwargs):
+        self.media += 1
+        if isinstance(media, str) and os.path.exists(media):
+            self.uploaded_bytes += os.path.getsize(media)
+        file_id = SimpleNamespace(file_id=f"fake-{uuid.uuid4().hex}")
+        message = SimpleNamespace(photo=None, document=None, audio=None, video=None)
+        setattr(message, kind, file_id)
+        return message
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._send_media('document', chat_id, document, **kwargs)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._send_media('photo', chat_id, photo, **kwargs)
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        return await self._send_media('audio', chat_id, audio, **kwargs)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._send_media('video', chat_id, video, **kwargs)
+
+# ------------------- Targets ------------------- #
+def subscriptions(opts: Dict, base_url: str):
+    """(user_id, url) pairs: each URL followed by ``subs`` distinct users"""
+    for i in range(opts['urls']):
+        for k in range(opts['subs']):
+            yield 1000 + (i * opts['subs'] + k) % opts['users'], f"{base_url}/page/{i}"
+
+async def run_rounds(opts: Dict, fake_web: FakeWeb, check_round) -> List[Dict]:
+    rounds = []
+    for n in range(opts['warmup'] + opts['rounds']):
+        if n:
+            await fake_web.next_round()
+        before = await fake_web.stats()
+        started = time.perf_counter()
+        latencies, checks = await check_round()
+        elapsed = time.perf_counter() - started
+        after = await fake_web.stats()
+        if n >= opts['warmup']:
+            rounds.append({
+                'elapsed': elapsed,
+                'checks': checks,
+                'latencies': latencies,
+                'bytes': after['bytes'] - before['bytes'],
+                'requests': after['requests'] - before['requests']
+            })
+    return rounds
+
+async def bench_delete(opts: Dict, base_url: str, fake_web: FakeWeb, client: FakeClient) -> List[Dict]:
+    for key, value in (('API_ID', '1'), ('API_HASH', 'benchmark'), ('BOT_TOKEN', '1:benchmark')):
+        os.environ.setdefault(key, value)
+    import delete
+    from host_policy import make_connector
+
+    if opts['mongo_uri']:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(opts['mongo_uri'])
+        db = mongo[f"url_tracker_bench_{uuid.uuid4().hex[:8]}"]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo = None
+        db = AsyncMongoMockClient()['url_tracker_bench']
+    for attr in ('users', 'urls', 'sudo', 'authorized', 'file_ids', 'sent', 'leases', 'workers'):
+        setattr(delete.MongoDB, attr, db[getattr(delete.MongoDB, attr).name])
+    await delete.MongoDB.sent.create_index([('url_id', 1), ('hash', 1)], unique=True)
+    await delete.MongoDB.file_ids.create_index([('hash', 1), ('type', 1)], unique=True)
+
+    if not opts['telegram_limits']:
+        delete.GLOBAL_SEND_RATE = delete.CHAT_SEND_RATE = 1e9
+
+    class BenchBot(delete.URLTrackerBot):
+        def initialize_handlers(self):
+            pass  # no Telegram updates in a benchmark
+
+    bot = BenchBot()
+    bot.app = client
+    bot.http = aiohttp.ClientSession(
+        connector=make_connector(delete.FETCH_CONCURRENCY + delete.CHECK_WORKERS, delete.FETCH_PER_HOST)
+    )
+    bot.dispatcher.start()
+    bot.downloads.start()
+
+    now = delete.datetime.now()
+    await delete.MongoDB.urls.insert_many([
+        {
+            'user_id': user_id, 'url': url, 'name': url.rsplit('/', 1)[-1], 'interval': 5,
+            'night_mode': False, 'shard': delete.shard_of(url), 'created_at': now
+        }
+        for user_id, url in subscriptions(opts, base_url)
+    ])
+
+    slots = asyncio.Semaphore(opts['concurrency'] or delete.CHECK_WORKERS)
+
+    async def check_round():
+        bot.page_cache.clear()  # rounds stand for intervals longer than SHARED_FETCH_WINDOW
+        latencies = []
+
+        async def check(doc):
+            async with slots:
+                started = time.perf_counter()
+                await bot.check_updates(doc['user_id'], doc['url'], doc)
+                latencies.append(time.perf_counter() - started)
+
+        docs = await delete.MongoDB.urls.find({}).to_list(None)
+        await asyncio.gather(*(check(doc) for doc in docs))
+        return latencies, len(docs)
+
+    try:
+        rounds = await run_rounds(opts, fake_web, check_round)
+        if opts['drain']:
+            try:
+                await asyncio.wait_for(drain(bot), opts['drain'])
+            except asyncio.TimeoutError:
+                print(f"Sends still pending after {opts['drain']}s", file=sys.stderr)
+        return rounds
+    finally:
+        await bot.dispatcher.stop()
+        await bot.downloads.stop()
+        await bot.http.close()
+        if mongo:
+            await mongo.drop_database(db.name)
+
+async def drain(bot):
+    while bot._tasks:
+        await asyncio.gather(*list(bot._tasks), return_exceptions=True)
+    while bot.dispatcher.pending:
+        await asyncio.sleep(0.05)
+
+async def bench_bot(opts: Dict, base_url: str, fake_web: FakeWeb, client: FakeClient) -> List[Dict]:
+    import bot as simple_bot
+    from host_policy import make_connector
+
+    if opts['concurrency']:
+        simple_bot.CHECK_CONCURRENCY = opts['concurrency']
+    simple_bot.http_session = aiohttp.ClientSession(
+        connector=make_connector(simple_bot.CHECK_CONCURRENCY, simple_bot.FETCH_PER_HOST),
+        timeout=aiohttp.ClientTimeout(total=simple_bot.FETCH_TIMEOUT)
+    )
+    for user_id, url in subscriptions(opts, base_url):
+        simple_bot.store.add(str(user_id), url, None, None)
+
+    latencies = []
+    checks = 0
+    check_subscribers = simple_bot.check_subscribers
+
+    async def timed(client, url, subs, slots):
+        # One fetch serves every subscriber of a URL, so latency is per URL;
+        # the clock starts once a slot is held, as in bench_delete
+        nonlocal checks
+        checks += len(subs)
+        async with slots:
+            started = time.perf_counter()
+            try:
+                return await check_subscribers(client, url, subs, contextlib.nullcontext())
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+    simple_bot.check_subscribers = timed
+
+    async def check_round():
+        nonlocal checks
+        latencies.clear()
+        checks = 0
+        await simple_bot.check_urls(client)
+        return list(latencies), checks
+
+    try:
+        return await run_rounds(opts, fake_web, check_round)
+    finally:
+        await simple_bot.http_session.close()
+
+# ------------------- Report ------------------- #
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def report(opts: Dict, rounds: List[Dict], client: FakeClient, rss_start: int) -> Dict:
+    latencies = [value for r in rounds for value in r['latencies']]
+    checks = sum(r['checks'] for r in rounds)
+    elapsed = sum(r['elapsed'] for r in rounds)
+    return {
+        'target': opts['target'],
+        'urls': opts['urls'],
+        'subscriptions': opts['urls'] * opts['subs'],
+        'rounds': len(rounds),
+        'checks': checks,
+        'checks_per_minute': round(checks / elapsed * 60, 1) if elapsed else 0,
+        'round_seconds': [round(r['elapsed'], 3) for r in rounds],
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'http_requests': sum(r['requests'] for r in rounds),
+        'http_bytes': sum(r['bytes'] for r in rounds),
+        'telegram_messages': client.messages,
+        'telegram_media': client.media,
+        'telegram_upload_bytes': client.uploaded_bytes,
+        'rss_start_mb': round(rss_start / 1024, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+async def main_async(opts: Dict):
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=run_server, args=(port, opts), daemon=True)
+    server.start()
+    try:
+        await wait_for_server(base_url)
+        fake_web = FakeWeb(base_url)
+        client = FakeClient()
+        try:
+            bench = bench_delete if opts['target'] == 'delete' else bench_bot
+            rounds = await bench(opts, base_url, fake_web, client)
+        finally:
+            await fake_web.close()
+        return report(opts, rounds, client, rss_start)
+    finally:
+        server.terminate()
+        server.join()
+
+def parse_args() -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', choices=('delete', 'bot'), default='delete')
+    parser.add_argument('--urls', type=int, default=200, help='distinct pages served')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--subs', type=int, default=1, help='subscribers per URL')
+    parser.add_argument('--rounds', type=int, default=3, help='measured check rounds')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured rounds that set baselines')
+    parser.add_argument('--page-kb', type=int, default=50)
+    parser.add_argument('--links', type=int, default=30, help='page links per page')
+    parser.add_argument('--media', type=int, default=0, help='media links per page')
+    parser.add_argument('--media-kb', type=int, default=512)
+    parser.add_argument('--churn', type=float, default=0.1, help='fraction of pages changing per round')
+    parser.add_argument('--no-etag', dest='etag', action='store_false', help='always send full pages')
+    parser.add_argument('--concurrency', type=int, default=0, help='check slots; 0 keeps the bot default')
+    parser.add_argument('--telegram-limits', action='store_true', help='keep the real send rate limits')
+    parser.add_argument('--drain', type=float, default=0, help='seconds to wait for queued sends to finish')
+    parser.add_argument('--mongo-uri', help='use a real MongoDB instead of mongomock_motor')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report to this file')
+    opts = vars(parser.parse_args())
+    if opts['subs'] > opts['users']:
+        parser.error('--subs cannot exceed --users')
+    return opts
+
+def main():
+    opts = parse_args()
+    if opts['json']:
+        opts['json'] = os.path.abspath(opts['json'])
+    # The bots keep their SQLite file and downloads relative to the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='url_tracker_bench_')
+    os.chdir(workdir)
+
+    result = asyncio.run(main_async(opts))
+    for key, value in result.items():
+        print(f"{key:>22}: {value}")
+    if opts['json']:
+        with open(opts['json'], 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
+import asyncio
 import logging
-from pyrogram import Client, filters
+import os
+import sqlite3
+from itertools import groupby
+from pyrogram import Client, enums, filters, idle
 from pyrogram.handlers import MessageHandler
-import requests
-import hashlib
+import aiohttp
 import json
-from apscheduler.schedulers.background import BackgroundScheduler
+import re
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bs4 import BeautifulSoup
+
+from content_diff import build_snapshot, compact, has_changes, format_changes
+from host_policy import HostPolicy, make_connector, backoff_factor, conditional_headers, extract_validators
+from metrics import REGISTRY, serve as serve_metrics
 
 # सेटअप लॉगिंग
 logging.basicConfig(
@@ -14,6 +23,23 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 USER_DATA_FILE = 'user_data.json'
+DB_FILE = 'user_data.db'
+CHECK_INTERVAL = 5  # minutes
+CHECK_CONCURRENCY = 20
+FETCH_TIMEOUT = 10  # seconds per URL
+FETCH_PER_HOST = 4
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # serves /metrics on localhost when set
+
+CHECK_ROUND_SECONDS = REGISTRY.histogram('bot_check_round_seconds', 'Time for one check_urls pass over every URL')
+FETCH_SECONDS = REGISTRY.histogram('bot_fetch_seconds', 'Time per page fetch')
+FETCHED_BYTES = REGISTRY.counter('bot_fetched_bytes_total', 'Page bytes downloaded')
+CHECKS = REGISTRY.counter('bot_checks_total', 'Subscription checks by outcome')
+
+# Created on the bot's event loop in run_bot()
+http_session = None
+host_policy = HostPolicy()
+check_lock = asyncio.Lock()
+check_round = 0
 
 def load_user_data():
     try:
@@ -22,108 +48,319 @@ def load_user_data():
     except (FileNotFoundError, json.JSONDecodeError):
         return {}
 
-def save_user_data(user_data):
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(user_data, f)
+class UserStore:
+    """Tracked URLs in SQLite (WAL mode), one row per user/URL, indexed by URL.
+
+    A single connection is used only from the bot's event loop (handlers and
+    the AsyncIOScheduler jobs), so statements never run concurrently.
+    """
+
+    COLUMNS = ('user_id', 'url', 'hash', 'validators', 'snapshot', 'selector', 'ignore_patterns', 'fail_count')
+    JSON_COLUMNS = ('validators', 'snapshot', 'ignore_patterns')
+
+    def __init__(self, path=DB_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tracked_urls ('
+                'user_id TEXT NOT NULL, url TEXT NOT NULL, hash TEXT, validators TEXT, '
+                'PRIMARY KEY (user_id, url))'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tracked_url ON tracked_urls (url)')
+            existing = {row['name'] for row in self.conn.execute('PRAGMA table_info(tracked_urls)')}
+            for column in ('snapshot', 'selector', 'ignore_patterns'):
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE tracked_urls ADD COLUMN {column} TEXT')
+            if 'fail_count' not in existing:
+                self.conn.execute('ALTER TABLE tracked_urls ADD COLUMN fail_count INTEGER NOT NULL DEFAULT 0')
+        self.migrate_json()
+
+    def _decode(self, row):
+        data = dict(row)
+        for column in self.JSON_COLUMNS:
+            data[column] = json.loads(data[column] or 'null')
+        data['ignore_patterns'] = data['ignore_patterns'] or []
+        return data
+
+    def migrate_json(self):
+        """Import a legacy user_data.json once, then move it aside"""
+        if not os.path.exists(USER_DATA_FILE):
+            return
+        rows = [
+            (user_id, u['url'], u['hash'], json.dumps(u.get('validators')))
+            for user_id, data in load_user_data().items()
+            for u in data.get('tracked_urls', [])
+        ]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO tracked_urls (user_id, url, hash, validators) VALUES (?, ?, ?, ?)',
+                rows
+            )
+        os.replace(USER_DATA_FILE, USER_DATA_FILE + '.migrated')
+        logger.info(f"Migrated {len(rows)} tracked URLs from {USER_DATA_FILE}")
+
+    def add(self, user_id, url, url_hash, validators, snapshot=None, selector=None):
+        try:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT INTO tracked_urls (user_id, url, hash, validators, snapshot, selector) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (user_id, url, url_hash, json.dumps(validators), json.dumps(snapshot), selector)
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def remove(self, user_id, url):
+        with self.conn:
+            cursor = self.conn.execute(
+                'DELETE FROM tracked_urls WHERE user_id = ? AND url = ?', (user_id, url)
+            )
+        return cursor.rowcount > 0
+
+    def update(self, user_id, url, url_hash, validators, snapshot):
+        with self.conn:
+            self.conn.execute(
+                'UPDATE tracked_urls SET hash = ?, validators = ?, snapshot = ? WHERE user_id = ? AND url = ?',
+                (url_hash, json.dumps(validators), json.dumps(snapshot), user_id, url)
+            )
 
-def fetch_url_content(url):
+    def record_fetch(self, url, ok):
+        """Count failed fetches of a URL for every subscriber; a success resets the count"""
+        with self.conn:
+            if ok:
+                self.conn.execute(
+                    'UPDATE tracked_urls SET fail_count = 0 WHERE url = ? AND fail_count > 0', (url,)
+                )
+            else:
+                self.conn.execute(
+                    'UPDATE tracked_urls SET fail_count = fail_count + 1 WHERE url = ?', (url,)
+                )
+
+    def set_ignore_patterns(self, user_id, url, patterns):
+        """Replace the ignore list; the stored snapshot is dropped so the next check sets a new baseline"""
+        with self.conn:
+            cursor = self.conn.execute(
+                'UPDATE tracked_urls SET ignore_patterns = ?, snapshot = NULL WHERE user_id = ? AND url = ?',
+                (json.dumps(patterns), user_id, url)
+            )
+        return cursor.rowcount > 0
+
+    def get(self, user_id, url):
+        row = self.conn.execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM tracked_urls WHERE user_id = ? AND url = ?',
+            (user_id, url)
+        ).fetchone()
+        return self._decode(row) if row else None
+
+    def is_tracked(self, user_id, url):
+        return self.get(user_id, url) is not None
+
+    def urls_for_user(self, user_id):
+        rows = self.conn.execute(
+            'SELECT url FROM tracked_urls WHERE user_id = ? ORDER BY rowid', (user_id,)
+        ).fetchall()
+        return [row['url'] for row in rows]
+
+    def subscriptions(self):
+        """All user/URL rows, grouped by URL"""
+        rows = self.conn.execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM tracked_urls ORDER BY url'
+        ).fetchall()
+        return [self._decode(row) for row in rows]
+
+store = UserStore()
+
+async def fetch_url_content(url, validators=None):
+    """Return (content, validators); content is None on 304 or on error."""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.text
+        with FETCH_SECONDS.time():
+            async with host_policy.request(
+                http_session, 'GET', url, headers=conditional_headers(validators)
+            ) as response:
+                if response.status == 304:
+                    store.record_fetch(url, True)
+                    return None, validators
+                response.raise_for_status()
+                FETCHED_BYTES.inc(len(await response.read()))
+                content = await response.text()
+                store.record_fetch(url, True)
+                return content, extract_validators(response.headers)
     except Exception as e:
         logger.error(f"Error fetching {url}: {e}")
-        return None
-
-def check_website_changes(url, previous_hash):
-    current_content = fetch_url_content(url)
-    if current_content:
-        current_hash = hashlib.sha256(current_content.encode()).hexdigest()
-        return current_hash != previous_hash, current_hash
-    return False, previous_hash
-
-def check_urls(client):
-    user_data = load_user_data()
-    for user_id, data in user_data.items():
-        for url_info in data['tracked_urls']:
-            url = url_info['url']
-            changed, new_hash = check_website_changes(url, url_info['hash'])
-            if changed:
-                client.send_message(
-                    chat_id=user_id,
-                    text=f"🚨 वेबसाइट में बदलाव आया है! {url}"
+        store.record_fetch(url, False)
+        return None, validators
+
+async def fetch_shared(url, validators=None, pages=None):
+    """Return (content, validators), fetching each URL only once per sweep.
+
+    ``pages`` is shared by every subscriber of the URL: a full response is
+    reused by all of them, a 304 only by those holding the same validators.
+    """
+    if pages is None:
+        pages = {}
+    if url in pages:
+        return pages[url]
+    key = (url, (validators or {}).get('etag'), (validators or {}).get('last_modified'))
+    if key not in pages:
+        content, new_validators = await fetch_url_content(url, validators)
+        if content:
+            pages[url] = (content, new_validators)
+            return pages[url]
+        pages[key] = (None, new_validators)
+    return pages[key]
+
+async def check_website_changes(url, sub, pages=None):
+    """Return (changes, hash, snapshot, validators) for one subscription.
+
+    ``snapshot`` is None when the page is unchanged or unreachable, and
+    ``changes`` is None when there is no earlier snapshot to compare with.
+    """
+    # Without a snapshot a 304 would never let a new baseline be recorded
+    content, validators = await fetch_shared(url, sub['validators'] if sub['snapshot'] else None, pages)
+    if not content:
+        return None, sub['hash'], None, validators
+
+    snapshot, changes = await build_snapshot(
+        content, url, sub['selector'], tuple(sub['ignore_patterns']), sub['snapshot']
+    )
+    if snapshot['hash'] == sub['hash'] and sub['snapshot']:
+        return None, sub['hash'], None, validators
+    return changes, snapshot['hash'], snapshot, validators
+
+async def check_subscribers(client, url, subs, slots):
+    """Check one URL for all of its subscribers"""
+    # A URL that keeps failing is only fetched every ``factor`` rounds
+    factor = backoff_factor(subs[0]['fail_count'])
+    if factor > 1 and (check_round + hash(url)) % factor:
+        CHECKS.inc(len(subs), result='skipped')
+        return
+
+    pages = {}
+    async with slots:
+        for sub in subs:
+            changes, new_hash, snapshot, validators = await check_website_changes(url, sub, pages)
+            if snapshot or validators != sub['validators']:
+                store.update(
+                    sub['user_id'], url, new_hash, validators,
+                    compact(snapshot) if snapshot else sub['snapshot']
                 )
-                url_info['hash'] = new_hash
-    save_user_data(user_data)
+            CHECKS.inc(result='changed' if has_changes(changes) else 'unchanged')
+            if has_changes(changes):
+                try:
+                    await client.send_message(
+                        chat_id=int(sub['user_id']),
+                        text=f"🚨 वेबसाइट में बदलाव आया है! {url}\n\n{format_changes(changes)}"[:4096],
+                        parse_mode=enums.ParseMode.DISABLED
+                    )
+                except Exception as e:
+                    logger.error(f"Error notifying {sub['user_id']}: {e}")
+
+async def check_urls(client):
+    global check_round
+    if check_lock.locked():
+        logger.warning("Previous check is still running, skipping this one")
+        return
+
+    async with check_lock:
+        check_round += 1
+        slots = asyncio.Semaphore(CHECK_CONCURRENCY)
+        with CHECK_ROUND_SECONDS.time():
+            await asyncio.gather(*(
+                check_subscribers(client, url, list(subs), slots)
+                for url, subs in groupby(store.subscriptions(), key=lambda sub: sub['url'])
+            ))
 
 async def start(client, message):
     await message.reply_text(
         'वेबसाइट ट्रैकिंग बॉट में आपका स्वागत है!\n\n'
         'कमांड्स:\n'
-        '/track <url> - वेबसाइट ट्रैक करें\n'
+        '/track <url> [css selector] - वेबसाइट ट्रैक करें\n'
+        '/ignore <url> [regex] - बदलती टेक्स्ट अनदेखा करें\n'
         '/untrack <url> - ट्रैकिंग रोकें\n'
         '/list - ट्रैक की गई वेबसाइट्स देखें'
     )
 
 async def track(client, message):
     user_id = str(message.from_user.id)
-    url = ' '.join(message.command[1:]).strip()
+    url = message.command[1].strip() if len(message.command) > 1 else ''
+    selector = ' '.join(message.command[2:]).strip() or None
 
     if not url.startswith(('http://', 'https://')):
         await message.reply_text("⚠ कृपया वैध URL डालें (http/https के साथ)")
         return
 
-    user_data = load_user_data()
-    if user_id not in user_data:
-        user_data[user_id] = {'tracked_urls': []}
+    if selector:
+        try:
+            BeautifulSoup('', 'lxml').select(selector)
+        except Exception:
+            await message.reply_text("⚠ अमान्य CSS सेलेक्टर")
+            return
 
-    if any(u['url'] == url for u in user_data[user_id]['tracked_urls']):
+    if store.is_tracked(user_id, url):
         await message.reply_text("❌ यह URL पहले से ट्रैक किया जा रहा है")
         return
 
-    content = fetch_url_content(url)
+    content, validators = await fetch_url_content(url)
     if not content:
         await message.reply_text("❌ URL एक्सेस नहीं किया जा सका")
         return
 
-    new_hash = hashlib.sha256(content.encode()).hexdigest()
-    user_data[user_id]['tracked_urls'].append({
-        'url': url,
-        'hash': new_hash
-    })
-    save_user_data(user_data)
+    snapshot, _ = await build_snapshot(content, url, selector)
+    store.add(user_id, url, snapshot['hash'], validators, compact(snapshot), selector)
     await message.reply_text(f"✅ ट्रैकिंग शुरू: {url}")
 
+async def ignore(client, message):
+    """/ignore <url> [regex] - बदलती टेक्स्ट (जैसे समय) को अनदेखा करें; बिना regex सूची साफ़"""
+    user_id = str(message.from_user.id)
+    if len(message.command) < 2:
+        await message.reply_text("⚠ /ignore <url> [regex]")
+        return
+
+    url = message.command[1].strip()
+    pattern = ' '.join(message.command[2:]).strip()
+    sub = store.get(user_id, url)
+    if not sub:
+        await message.reply_text("❌ URL नहीं मिला")
+        return
+
+    if pattern:
+        try:
+            re.compile(pattern)
+        except re.error:
+            await message.reply_text("⚠ अमान्य पैटर्न")
+            return
+        store.set_ignore_patterns(user_id, url, sub['ignore_patterns'] + [pattern])
+        await message.reply_text(f"✅ अनदेखा किया जाएगा: {pattern}")
+    else:
+        store.set_ignore_patterns(user_id, url, [])
+        await message.reply_text("✅ अनदेखी सूची साफ़")
+
 async def untrack(client, message):
     user_id = str(message.from_user.id)
     url = ' '.join(message.command[1:]).strip()
 
-    user_data = load_user_data()
-    if user_id not in user_data:
+    if not store.urls_for_user(user_id):
         await message.reply_text("❌ कोई ट्रैक किए गए URL नहीं मिले")
         return
 
-    original_count = len(user_data[user_id]['tracked_urls'])
-    user_data[user_id]['tracked_urls'] = [
-        u for u in user_data[user_id]['tracked_urls']
-        if u['url'] != url
-    ]
-
-    if len(user_data[user_id]['tracked_urls']) < original_count:
-        save_user_data(user_data)
+    if store.remove(user_id, url):
         await message.reply_text(f"❎ ट्रैकिंग बंद: {url}")
     else:
         await message.reply_text("❌ URL नहीं मिला")
 
 async def list_urls(client, message):
     user_id = str(message.from_user.id)
-    user_data = load_user_data()
+    tracked = store.urls_for_user(user_id)
 
-    if user_id not in user_data or not user_data[user_id]['tracked_urls']:
+    if not tracked:
         await message.reply_text("📭 आपने अभी कोई URL ट्रैक नहीं किया है")
         return
 
-    urls = "\n".join([u['url'] for u in user_data[user_id]['tracked_urls']])
+    urls = "\n".join(tracked)
     await message.reply_text(f"📜 ट्रैक किए गए URLs:\n\n{urls}")
 
 def main():
@@ -133,15 +370,40 @@ def main():
     app.add_handler(MessageHandler(track, filters.command("track")))
     app.add_handler(MessageHandler(untrack, filters.command("untrack")))
     app.add_handler(MessageHandler(list_urls, filters.command("list")))
+    app.add_handler(MessageHandler(ignore, filters.command("ignore")))
+
+    app.run(run_bot(app))
+
+async def run_bot(app):
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=make_connector(CHECK_CONCURRENCY, FETCH_PER_HOST),
+        timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+    )
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(
+        check_urls, 'interval', minutes=CHECK_INTERVAL, args=[app],
+        max_instances=1, coalesce=True
+    )
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(check_urls, 'interval', minutes=5, args=[app])
-    scheduler.start()
+    metrics_runner = None
 
     try:
-        app.run()
+        await app.start()
+        if METRICS_PORT:
+            metrics_runner = await serve_metrics(METRICS_PORT)
+        scheduler.start()
+        await idle()
     except Exception as e:
         logger.error(f"Error running the bot: {e}")
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await http_session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if app.is_connected:
+            await app.stop()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,271 @@
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, unquote
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+# Markup that never carries meaningful page content. Not <form>: WebForms
+# sites wrap the whole body in one, so only the controls themselves go
+NOISE_TAGS = [
+    'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'head', 'nav', 'footer', 'aside',
+    'input', 'select', 'option', 'button'
+]
+BLOCK_TAGS = [
+    'p', 'li', 'td', 'th', 'dt', 'dd', 'pre', 'blockquote', 'caption',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div', 'section', 'article'
+]
+SIMHASH_THRESHOLD = 4  # max differing bits for two blocks to count as one edited block
+EXCERPT_WIDTH = 200  # stored characters per block, enough to show what was removed
+MAX_BLOCKS = 2000
+MAX_LINKS = 500
+SNAPSHOT_CACHE_SIZE = 64
+
+_snapshots: OrderedDict = OrderedDict()
+_snapshots_lock = threading.Lock()  # page_snapshot also runs on executor threads
+
+def simhash(text: str) -> int:
+    """64-bit simhash over word trigrams; near-identical text gives near-identical bits"""
+    tokens = re.findall(r'\w+', text.lower())
+    features = [' '.join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))]
+    # Count set bits per position with bit-sliced counters: planes[k] holds
+    # bit k of all 64 counts, so each feature costs a few big-int operations
+    planes: List[int] = []
+    for feature in features:
+        carry = int.from_bytes(hashlib.md5(feature.encode()).digest()[:8], 'big')
+        for k, plane in enumerate(planes):
+            planes[k], carry = plane ^ carry, plane & carry
+            if not carry:
+                break
+        if carry:
+            planes.append(carry)
+    # A bit is set when more features have it set than not
+    result = 0
+    for bit in range(64):
+        ones = sum((plane >> bit & 1) << k for k, plane in enumerate(planes))
+        if 2 * ones > len(features):
+            result |= 1 << bit
+    return result
+
+def normalize(text: str, ignore_patterns: Tuple[str, ...] = ()) -> str:
+    for pattern in ignore_patterns:
+        text = re.sub(pattern, '', text)
+    return ' '.join(text.split())
+
+def _select_parts(html: str, base_url: str, selector: str, ignore_patterns: Tuple[str, ...]):
+    """Texts and links of the elements matching a CSS selector"""
+    soup = BeautifulSoup(html, 'lxml')
+    # Select first so a rule can target anything, then drop noise inside the matches
+    roots = soup.select(selector)
+    for root in roots:
+        for tag in root.find_all(NOISE_TAGS):
+            tag.decompose()
+
+    texts, links = [], set()
+    for root in roots:
+        blocks = [el for el in root.find_all(BLOCK_TAGS) if el.find(BLOCK_TAGS) is None] or [root]
+        for block in blocks:
+            text = normalize(block.get_text(' '), ignore_patterns)
+            if text:
+                texts.append(text)
+        for a in root.find_all('a', href=True):
+            links.add(unquote(urljoin(base_url, a['href'])))
+    return texts, links
+
+def _page_parts(html: str, base_url: str, ignore_patterns: Tuple[str, ...]):
+    """Texts and links of the whole body, from one lxml tree.
+
+    Yields the same blocks as the soup walk in _select_parts: block elements
+    without a nested block, or the body itself when there are none.
+    """
+    parser = etree.HTMLParser()
+    parser.feed(html or ' ')
+    doc = parser.close()
+    if doc is None:
+        return [], set()
+    etree.strip_elements(doc, etree.Comment, etree.ProcessingInstruction, *NOISE_TAGS, with_tail=False)
+    root = doc.find('body')
+    if root is None:
+        root = doc
+
+    elements = list(root.iterdescendants(BLOCK_TAGS))
+    nested = set()  # blocks with a block inside
+    for el in elements:
+        parent = el.getparent()
+        while parent is not None and parent is not root:
+            if parent.tag in BLOCK_TAGS:
+                if parent in nested:
+                    break
+                nested.add(parent)
+            parent = parent.getparent()
+
+    texts = []
+    for block in [el for el in elements if el not in nested] or [root]:
+        text = normalize(' '.join(block.itertext()), ignore_patterns)
+        if text:
+            texts.append(text)
+            if len(texts) >= MAX_BLOCKS:
+                break
+    links = {
+        unquote(urljoin(base_url, a.get('href')))
+        for a in root.iterdescendants('a') if a.get('href') is not None
+    }
+    return texts, links
+
+def page_snapshot(
+    html: str,
+    base_url: str,
+    selector: Optional[str] = None,
+    ignore_patterns: Tuple[str, ...] = ()
+) -> Dict:
+    """Reduce a page to its main text blocks and link set.
+
+    ``selector`` limits extraction to matching elements and ``ignore_patterns``
+    are regexes stripped from every block before fingerprinting. Recent
+    results are cached by URL, page digest and rules, so subscribers sharing
+    a fetch and rules build it once.
+    """
+    key = (base_url, hashlib.md5(html.encode()).digest(), selector, ignore_patterns)
+    with _snapshots_lock:
+        if key in _snapshots:
+            _snapshots.move_to_end(key)
+            return _snapshots[key]
+
+    if selector:
+        texts, links = _select_parts(html, base_url, selector, ignore_patterns)
+    else:
+        texts, links = _page_parts(html, base_url, ignore_patterns)
+    texts = texts[:MAX_BLOCKS]
+    links = sorted(links)[:MAX_LINKS]
+    blocks = [f"{simhash(text):016x}" for text in texts]
+    digests = [hashlib.md5(text.encode()).hexdigest()[:16] for text in texts]
+    digest = hashlib.md5('\n'.join(digests + links).encode()).hexdigest()
+    snapshot = {'hash': digest, 'blocks': blocks, 'digests': digests, 'texts': texts, 'links': links}
+
+    with _snapshots_lock:
+        _snapshots[key] = snapshot
+        while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return snapshot
+
+def _snapshot_changes(
+    html: str,
+    base_url: str,
+    selector: Optional[str],
+    ignore_patterns: Tuple[str, ...],
+    previous: Optional[Dict]
+) -> Tuple[Dict, Optional[Dict]]:
+    snapshot = page_snapshot(html, base_url, selector, ignore_patterns)
+    return snapshot, diff_snapshots(previous, snapshot) if previous else None
+
+async def build_snapshot(
+    html: str,
+    base_url: str,
+    selector: Optional[str] = None,
+    ignore_patterns: Tuple[str, ...] = (),
+    previous: Optional[Dict] = None
+) -> Tuple[Dict, Optional[Dict]]:
+    """page_snapshot and its diff against ``previous`` on the default executor.
+
+    Parsing and diffing large pages never stall the event loop; the changes
+    are None when there is no earlier snapshot to compare with.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _snapshot_changes, html, base_url, selector, ignore_patterns, previous
+    )
+
+def compact(snapshot: Dict) -> Dict:
+    """The part of a snapshot worth storing: block fingerprints, excerpts and links"""
+    return {
+        'blocks': snapshot['blocks'],
+        'digests': snapshot['digests'],
+        'excerpts': [text[:EXCERPT_WIDTH] for text in snapshot['texts']],
+        'links': snapshot['links']
+    }
+
+def _bands(value: int, threshold: int) -> List[Tuple[int, int]]:
+    """Split 64 bits into threshold + 1 bands; hashes within threshold bits share one"""
+    count = threshold + 1
+    bounds = [64 * i // count for i in range(count + 1)]
+    return [(i, value >> lo & ((1 << (hi - lo)) - 1)) for i, (lo, hi) in enumerate(zip(bounds, bounds[1:]))]
+
+def diff_snapshots(old: Dict, new: Dict, threshold: int = SIMHASH_THRESHOLD) -> Dict[str, List]:
+    """Added, modified and removed blocks plus link changes between two snapshots.
+
+    Blocks with the same exact digest are unchanged. The rest are paired by
+    simhash within ``threshold`` bits and reported as modified; whatever is
+    left is added or removed. Snapshots stored before digests existed pair on
+    simhash alone.
+    """
+    old_blocks = [int(fp, 16) for fp in old.get('blocks', [])]
+    old_digests = old.get('digests') or [None] * len(old_blocks)
+    excerpts = old.get('excerpts') or [''] * len(old_blocks)
+
+    by_digest = defaultdict(list)
+    for i, digest in enumerate(old_digests):
+        if digest is not None:
+            by_digest[digest].append(i)
+    matched = set()
+    rest = []
+    for j, digest in enumerate(new['digests']):
+        candidates = by_digest.get(digest)
+        if candidates:
+            matched.add(candidates.pop())
+        else:
+            rest.append(j)
+
+    by_band = defaultdict(list)
+    for i, value in enumerate(old_blocks):
+        if i not in matched:
+            for band in _bands(value, threshold):
+                by_band[band].append(i)
+    added, modified = [], []
+    for j in rest:
+        value = int(new['blocks'][j], 16)
+        near = None
+        for band in _bands(value, threshold):
+            candidates = by_band.get(band, [])
+            while candidates and candidates[-1] in matched:
+                candidates.pop()
+            near = next(
+                (i for i in reversed(candidates)
+                 if i not in matched and bin(old_blocks[i] ^ value).count('1') <= threshold),
+                None
+            )
+            if near is not None:
+                break
+        if near is None:
+            added.append(new['texts'][j])
+            continue
+        matched.add(near)
+        # Legacy snapshots have no digest, so an identical simhash is all there is to go on
+        if old_digests[near] is not None or old_blocks[near] != value:
+            modified.append(new['texts'][j])
+
+    old_links, new_links = set(old.get('links', [])), set(new['links'])
+    return {
+        'added': added,
+        'modified': modified,
+        'removed': [excerpts[i] for i in range(len(old_blocks)) if i not in matched],
+        'links_added': sorted(new_links - old_links),
+        'links_removed': sorted(old_links - new_links)
+    }
+
+def has_changes(changes: Optional[Dict]) -> bool:
+    return bool(changes) and any(changes.values())
+
+def format_changes(changes: Dict, limit: int = 10, width: int = EXCERPT_WIDTH) -> str:
+    lines = [f"➕ {text[:width]}" for text in changes['added'][:limit]]
+    lines += [f"✏️ {text[:width]}" for text in changes['modified'][:limit]]
+    removed = [text for text in changes['removed'] if text]
+    lines += [f"➖ {text[:width]}" for text in removed[:limit]]
+    # Snapshots stored before excerpts existed only tell how many blocks went
+    if len(changes['removed']) > len(removed):
+        lines.append(f"➖ ({len(changes['removed']) - len(removed)})")
+    lines += [f"🔗 + {link}" for link in changes['links_added'][:limit]]
+    lines += [f"🔗 − {link}" for link in changes['links_removed'][:limit]]
+    return '\n'.join(lines)
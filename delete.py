@@ -5,12 +5,31 @@ import asyncio
 import aiohttp
 import aiofiles
 import hashlib
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import shutil
+import socket
+import time
+import uuid
 import yt_dlp
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import chain, zip_longest
 from urllib.parse import urlparse, urljoin, unquote
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
 
-from pyrogram import Client, filters, enums
+from pyrogram import Client, filters, enums, idle
+from pyrogram.errors import (
+    BadRequest, FloodWait, Forbidden, FileIdInvalid, FileReferenceExpired, MediaEmpty
+)
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 from pyrogram.types import (
     Message,
     InlineKeyboardMarkup,
@@ -19,13 +38,22 @@ from pyrogram.types import (
     Document
 )
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from apscheduler.events import EVENT_JOB_SUBMITTED
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.combining import AndTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
 from bs4 import BeautifulSoup
+from lxml import etree
 from aiofiles import os as async_os
 
+from content_diff import build_snapshot, compact, has_changes, format_changes
+from host_policy import HostPolicy, make_connector, backoff_factor, conditional_headers, extract_validators
+from metrics import REGISTRY, SamplingProfiler, serve as serve_metrics
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -44,6 +72,48 @@ SUPPORTED_EXTENSIONS = {
     'audio': ['.mp3', '.wav', '.ogg', '.m4a'],
     'video': ['.mp4', '.mkv', '.mov', '.webm']
 }
+RESOURCE_TAGS = {'a', 'img', 'audio', 'video', 'source'}
+ALL_EXTENSIONS = {ext for extensions in SUPPORTED_EXTENSIONS.values() for ext in extensions}
+PARSED_PAGES_MAX = 1024
+CHUNK_SIZE = 64 * 1024
+RESOURCE_CACHE_SIZE = 10000
+RESOURCE_CACHE_TTL = 30 * 60  # seconds before a cached fingerprint is revalidated
+FETCH_CONCURRENCY = 32
+FETCH_PER_HOST = 4
+RESOURCE_TIMEOUT = 20  # seconds per resource request
+
+# Scheduling: 'jobs' registers one APScheduler job per tracked URL,
+# 'sweep' runs a single periodic job over a queue of next-due URLs
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "jobs")
+SWEEP_TICK = 5  # seconds between sweeps
+SWEEP_JITTER = 0.1  # +/- fraction of the interval added to each reschedule
+CHECK_WORKERS = 16
+WARMUP_WINDOW = 10 * 60  # seconds over which overdue checks are spread after a restart
+SCHEDULE_FIELDS = {'user_id': 1, 'url': 1, 'interval': 1, 'night_mode': 1, 'last_checked': 1, 'created_at': 1}
+SHARED_FETCH_WINDOW = 60  # seconds a page fetch is reused across subscribers
+PAGE_CACHE_MAX = 2048
+DOWNLOAD_CACHE_DIR = 'downloads/cache'
+DOWNLOAD_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB
+
+# Outbound Telegram limits
+SEND_WORKERS = 4
+GLOBAL_SEND_RATE = 25  # messages per second for the whole bot, split evenly between live workers
+CHAT_SEND_RATE = 1  # messages per second per chat
+SEND_RETRIES = 5
+NIGHT_HOURS = range(6, 23)  # hours in which night-mode URLs are checked
+YTDL_WORKERS = 2  # yt-dlp processes; each runs one extraction or download at a time
+YTDL_INFO_TTL = 10 * 60  # seconds an extract_info result is reused
+PRIORITY_COMMAND = 0  # /dl requests jump ahead of
+PRIORITY_TRACKING = 10  # media found by tracked URLs
+# Deployment: 'standalone' does everything in one process, 'frontend' only
+# serves Telegram commands, 'worker' only checks the shards it holds leases on
+BOT_MODE = os.getenv("BOT_MODE", "standalone")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+SHARD_COUNT = 64
+LEASE_TTL = 30  # seconds a shard lease or worker heartbeat stays valid
+HEARTBEAT_INTERVAL = 10
+AUTH_CACHE_TTL = 5 * 60  # seconds between full reloads of sudo users/authorized chats
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # serves /metrics on localhost when set
 
 # MongoDB Configuration
 MONGO_URI = os.getenv("MONGO_URI")
@@ -53,23 +123,689 @@ DB_NAME = "url_tracker_bot"
 mongo_client = AsyncIOMotorClient(MONGO_URI)
 db = mongo_client[DB_NAME]
 
+# Metrics
+CHECK_SECONDS = REGISTRY.histogram('tracker_check_seconds', 'Time per stage of a URL check')
+CHECKS = REGISTRY.counter('tracker_checks_total', 'URL checks by outcome')
+FETCHED_BYTES = REGISTRY.counter('tracker_fetched_bytes_total', 'Bytes downloaded, by kind')
+SEND_SECONDS = REGISTRY.histogram('tracker_send_media_seconds', 'Time to deliver one resource, by path')
+YTDL_SECONDS = REGISTRY.histogram('tracker_ytdl_seconds', 'Time per yt-dlp download, queue wait included')
+SCHEDULER_LAG = REGISTRY.histogram('tracker_scheduler_lag_seconds', 'Delay between a check falling due and starting')
+
+def uploaded_file_id(message: Optional[Message]) -> Optional[str]:
+    """Pull the reusable file_id out of the message Telegram returns after an upload"""
+    if not message:
+        return None
+    if message.photo:
+        return message.photo.file_id
+    for media in (message.document, message.audio, message.video):
+        if media:
+            return media.file_id
+    return None
+
+def resource_type(url: str) -> Optional[str]:
+    """Map a resource URL to its SUPPORTED_EXTENSIONS type, ignoring the query string"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    for file_type, extensions in SUPPORTED_EXTENSIONS.items():
+        if ext in extensions:
+            return file_type
+    return None
+
+class ResourceLinkTarget:
+    """lxml parser target that collects resource links without building a tree.
+
+    Only start tags are handled; links are checked for a supported extension
+    before they are resolved against the page URL.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.links: Dict[str, str] = {}
+
+    def start(self, tag, attrib):
+        if tag not in RESOURCE_TAGS:
+            return
+        value = attrib.get('href') if tag == 'a' and attrib.get('href') else attrib.get('src')
+        if not value:
+            return
+        if os.path.splitext(unquote(urlparse(value).path))[1].lower() not in ALL_EXTENSIONS:
+            return
+        resource_url = unquote(urljoin(self.base_url, value))
+        if file_type := resource_type(resource_url):
+            self.links.setdefault(resource_url, file_type)
+
+    def close(self) -> Dict[str, str]:
+        return self.links
+
+def extract_resource_links(html: str, base_url: str) -> Dict[str, str]:
+    """Map each supported resource URL on the page to its type, in page order"""
+    parser = etree.HTMLParser(target=ResourceLinkTarget(base_url))
+    parser.feed(html)
+    return parser.close()
+
+def same_resource(cached: Dict, current: Dict) -> bool:
+    """Compare validators, strongest first: ETag, Last-Modified, Content-Length"""
+    for key in ('etag', 'last_modified', 'content_length'):
+        if cached.get(key) and current.get(key):
+            return cached[key] == current[key]
+    return False
+
+class ResourceCache:
+    """Resource fingerprints keyed by URL, with TTL and LRU eviction"""
+
+    def __init__(self, max_entries: int = RESOURCE_CACHE_SIZE, ttl: int = RESOURCE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, url: str) -> Optional[Dict]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.monotonic() - entry['checked_at'] < self.ttl
+
+    def touch(self, url: str):
+        if url in self._entries:
+            self._entries[url]['checked_at'] = time.monotonic()
+
+    def put(self, url: str, file_hash: str, validators: Dict):
+        self._entries[url] = {
+            'hash': file_hash,
+            'validators': validators,
+            'checked_at': time.monotonic()
+        }
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class FetchPool:
+    """Runs fetches under a global and a per-host concurrency limit"""
+
+    def __init__(self, limit: int = FETCH_CONCURRENCY, per_host: int = FETCH_PER_HOST):
+        self.per_host = per_host
+        self._global = asyncio.Semaphore(limit)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    async def run(self, url: str, func):
+        # Take the host slot first so a task queued behind a busy host
+        # does not hold one of the global slots while it waits
+        async with self._host_slot(url):
+            async with self._global:
+                return await func(url)
+
+    async def map(self, urls: List[str], func) -> Dict[str, object]:
+        """Run func(url) for every URL, interleaving hosts round-robin so one
+        link-heavy host cannot starve the others."""
+        by_host: Dict[str, List[str]] = OrderedDict()
+        for url in urls:
+            by_host.setdefault(urlparse(url).netloc, []).append(url)
+        ordered = [u for u in chain.from_iterable(zip_longest(*by_host.values())) if u]
+        results = await asyncio.gather(*(self.run(u, func) for u in ordered))
+        return dict(zip(ordered, results))
+
+class SweepScheduler:
+    """Priority queue of tracked URL ids ordered by their next due time"""
+
+    def __init__(self, jitter: float = SWEEP_JITTER):
+        self.jitter = jitter
+        self._heap: List[Tuple[float, object]] = []
+        self._due: Dict[object, float] = {}  # superseded heap entries are skipped on pop
+        self.lag = 0.0  # how late the oldest entry of the last pop_due was
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _push(self, doc_id, due: float):
+        self._due[doc_id] = due
+        heapq.heappush(self._heap, (due, doc_id))
+
+    def add(self, doc_id, interval: int, first_due: Optional[float] = None):
+        if first_due is None:
+            # Spread first runs across one interval so equal intervals do not align
+            first_due = time.time() + random.uniform(0, interval * 60)
+        self._push(doc_id, first_due)
+
+    def reschedule(self, doc_id, interval: int):
+        delay = interval * 60
+        delay += random.uniform(-self.jitter, self.jitter) * delay
+        self._push(doc_id, time.time() + delay)
+
+    def retry(self, doc_ids: List, delay: float):
+        """Put popped ids back, due after ``delay`` seconds, unless rescheduled meanwhile"""
+        due = time.time() + delay
+        for doc_id in doc_ids:
+            if doc_id not in self._due:
+                self._push(doc_id, due)
+
+    def remove(self, doc_id):
+        self._due.pop(doc_id, None)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._due
+
+    def pop_due(self, now: Optional[float] = None) -> List:
+        now = now or time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            ts, doc_id = heapq.heappop(self._heap)
+            if self._due.get(doc_id) == ts:
+                if not due:
+                    self.lag = now - ts
+                del self._due[doc_id]
+                due.append(doc_id)
+        return due
+
+class DownloadCache:
+    """Size-bounded on-disk cache of downloaded resources.
+
+    Entries are keyed by resource URL and content hash and evicted least
+    recently used first. Entries with a non-zero reference count are being
+    uploaded and are never evicted.
+    """
+
+    def __init__(self, directory: str = DOWNLOAD_CACHE_DIR, max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self._refs: Dict[str, int] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._load_index()
+        self.total_bytes = sum(entry['size'] for entry in self.index.values())
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {k: v for k, v in index.items() if os.path.exists(v['path'])}
+
+    async def _save_index(self):
+        async with aiofiles.open(self.index_path, 'w') as f:
+            await f.write(json.dumps(self.index))
+
+    @asynccontextmanager
+    async def acquire(self, url: str, content_hash: str, loader):
+        """Yield a local path for the resource, calling loader(url) only on a miss"""
+        key = f"{url}#{content_hash}"
+        path = await self._ensure(key, url, loader)
+        try:
+            yield path
+        finally:
+            if path:
+                self._refs[key] -= 1
+                if not self._refs[key]:
+                    del self._refs[key]
+
+    def _pick(self, key: str) -> Optional[str]:
+        """Take a reference on a cached entry, if it is still there"""
+        entry = self.index.get(key)
+        if entry and os.path.exists(entry['path']):
+            entry['last_used'] = time.time()
+            self._refs[key] = self._refs.get(key, 0) + 1
+            return entry['path']
+        return None
+
+    async def _ensure(self, key: str, url: str, loader) -> Optional[str]:
+        path = self._pick(key)
+        # Load again once in case the entry was evicted between load and pickup
+        for _ in range(2):
+            if path:
+                return path
+            task = self._loading.get(key)
+            if task is None:
+                task = asyncio.create_task(self._load(key, url, loader))
+                self._loading[key] = task
+                task.add_done_callback(lambda t: self._loading.pop(key, None))
+            if not await asyncio.shield(task):
+                return None
+            path = self._pick(key)
+        return path
+
+    async def _load(self, key: str, url: str, loader) -> bool:
+        file_path = await loader(url)
+        if not file_path:
+            return False
+
+        ext = os.path.splitext(file_path)[1]
+        dest = os.path.join(self.directory, hashlib.md5(key.encode()).hexdigest() + ext)
+        await async_os.replace(file_path, dest)
+        if key in self.index:
+            self.total_bytes -= self.index[key]['size']
+        size = os.path.getsize(dest)
+        self.index[key] = {'path': dest, 'size': size, 'last_used': time.time()}
+        self.total_bytes += size
+        await self._evict(keep=key)
+        await self._save_index()
+        return True
+
+    async def _evict(self, keep: Optional[str] = None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, entry in sorted(self.index.items(), key=lambda kv: kv[1]['last_used']):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep or self._refs.get(key):
+                continue
+            del self.index[key]
+            self.total_bytes -= entry['size']
+            if os.path.exists(entry['path']):
+                await async_os.remove(entry['path'])
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, otherwise seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class NotificationDispatcher:
+    """Central outbound queue for Telegram requests.
+
+    Each job is a zero-argument coroutine function performing one API call.
+    Jobs wait in per-chat queues, and a chat id sits in ``ready`` while it has
+    jobs and no sender is working on it, so jobs for one chat go out in order.
+    A chat that is out of tokens, in FloodWait or backing off after an error
+    is parked on a timer instead of holding a sender, so one slow chat never
+    delays the others. Other transient errors are retried with exponential
+    backoff.
+    """
+
+    def __init__(self, senders: int = SEND_WORKERS):
+        self.senders = senders
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.chat_jobs: Dict[int, deque] = {}  # only chats with pending jobs
+        self.global_bucket = TokenBucket(GLOBAL_SEND_RATE, GLOBAL_SEND_RATE)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.pending = 0
+        self.flood_waits = 0
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.senders)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def set_global_rate(self, rate: float):
+        """Change this process's share of the bot-wide send rate"""
+        bucket = self.global_bucket
+        bucket.rate = bucket.capacity = rate
+        bucket.tokens = min(bucket.tokens, rate)
+
+    def submit(self, chat_id: int, call) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if chat_id not in self.chat_jobs:
+            self.chat_jobs[chat_id] = deque()
+            self.ready.put_nowait(chat_id)
+        self.chat_jobs[chat_id].append([call, future, 0])
+        self.pending += 1
+        return future
+
+    async def send(self, chat_id: int, call):
+        """Queue a call and wait for its result"""
+        return await self.submit(chat_id, call)
+
+    def post(self, chat_id: int, call):
+        """Queue a call without waiting; failures are only logged"""
+        self.submit(chat_id, call).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.error(f"Message sending failed: {str(future.exception())}")
+
+    def _park(self, chat_id: int, delay: float):
+        asyncio.get_running_loop().call_later(delay, self.ready.put_nowait, chat_id)
+
+    def _finish(self, chat_id: int, result=None, error: Optional[Exception] = None):
+        _, future, _ = self.chat_jobs[chat_id].popleft()
+        self.pending -= 1
+        if future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(CHAT_SEND_RATE, 1))
+            if (delay := bucket.take()) > 0:
+                self._park(chat_id, delay)
+                continue
+            # The global limit holds every chat back alike, so waiting here is fair
+            while (delay := self.global_bucket.take()) > 0:
+                await asyncio.sleep(delay)
+
+            job = self.chat_jobs[chat_id][0]
+            retry_in = 0
+            try:
+                self._finish(chat_id, await job[0]())
+            except FloodWait as e:
+                self.flood_waits += 1
+                logger.warning(f"FloodWait: parking chat {chat_id} for {e.value}s")
+                retry_in = e.value
+            except (BadRequest, Forbidden) as e:
+                # Blocked bot, deleted chat, bad file_id: retrying cannot help
+                self._finish(chat_id, error=e)
+            except Exception as e:
+                job[2] += 1
+                if job[2] >= SEND_RETRIES:
+                    self._finish(chat_id, error=e)
+                else:
+                    retry_in = 2 ** job[2]
+
+            if retry_in:
+                self._park(chat_id, retry_in)
+            elif self.chat_jobs[chat_id]:
+                self.ready.put_nowait(chat_id)
+            else:
+                del self.chat_jobs[chat_id]
+
+def tracking_job_id(tracked_data: Dict) -> str:
+    return f"{tracked_data['user_id']}_{hashlib.md5(tracked_data['url'].encode()).hexdigest()}"
+
+def night_paused(night_mode: bool) -> bool:
+    """Night-mode URLs are only checked during NIGHT_HOURS"""
+    return bool(night_mode) and datetime.now(ZoneInfo(TIMEZONE)).hour not in NIGHT_HOURS
+
+def first_due(tracked_data: Dict, now: Optional[float] = None) -> float:
+    """Next check time for a restored URL.
+
+    Keeps the phase of the last check so a restart does not realign every
+    URL; checks that became overdue while the bot was down are spread over
+    WARMUP_WINDOW (or the interval, if shorter) instead of firing at once.
+    """
+    now = now or time.time()
+    interval = tracked_data['interval'] * 60
+    last = tracked_data.get('last_checked') or tracked_data.get('created_at')
+    due = last.timestamp() + interval if last else now
+    if due <= now:
+        due = now + random.uniform(0, min(WARMUP_WINDOW, interval))
+    return due
+
+def shard_of(url: str) -> int:
+    """Shards split tracked URLs by URL, so one worker sees every subscriber of a page"""
+    return int(hashlib.md5(url.encode()).hexdigest()[:8], 16) % SHARD_COUNT
+
+def ytdl_extract(url: str, opts: Dict) -> Tuple[Dict, str]:
+    """Run in a worker process: return the sanitized info dict and target filename"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if 'entries' in info:
+            info = info['entries'][0]
+        return ydl.sanitize_info(info), ydl.prepare_filename(info)
+
+def ytdl_fetch(url: str, opts: Dict):
+    """Run in a worker process: download url with yt-dlp"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.download([url])
+
+class DownloadManager:
+    """yt-dlp jobs on a bounded process pool, fed from a priority queue.
+
+    Concurrent requests for one URL share a single job, and a higher priority
+    request re-queues a pending URL ahead of its old position. Every caller
+    gets its own hard link to the result, since callers delete or move their
+    file; the shared file is removed once all of them have one.
+    extract_info results are cached for YTDL_INFO_TTL seconds.
+    """
+
+    def __init__(self, ydl_opts: Dict, workers: int = YTDL_WORKERS):
+        self.ydl_opts = ydl_opts
+        self.workers = workers
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.waiters: Dict[str, int] = {}
+        self.running = set()
+        self.info_cache: Dict[str, Tuple[float, Tuple[Dict, str]]] = {}
+        self._seq = itertools.count()
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.inflight) - len(self.running)
+
+    def start(self):
+        # Workers start lazily, after Motor and Pyrogram threads are running;
+        # forking then can inherit a held lock, so they come from a clean server
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver')
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def download(self, url: str, priority: int = PRIORITY_TRACKING) -> str:
+        """Queue url and return a filename owned by the caller; yt-dlp errors are raised"""
+        future = self.inflight.get(url)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[url] = future
+            future.add_done_callback(lambda f: self.inflight.pop(url, None))
+            self.queue.put_nowait((priority, next(self._seq), url, future))
+        elif url not in self.running:
+            # Stale lower-priority entries are skipped once the future is done
+            self.queue.put_nowait((priority, next(self._seq), url, future))
+
+        self.waiters[url] = self.waiters.get(url, 0) + 1
+        try:
+            return await self._claim(await asyncio.shield(future))
+        finally:
+            self.waiters[url] -= 1
+            if not self.waiters[url]:
+                del self.waiters[url]
+                if future.done() and not future.cancelled() and not future.exception() \
+                        and os.path.exists(future.result()):
+                    await async_os.remove(future.result())
+
+    async def _claim(self, filename: str) -> str:
+        root, ext = os.path.splitext(filename)
+        private = f"{root}.{uuid.uuid4().hex[:8]}{ext}"
+        try:
+            await async_os.link(filename, private)
+        except OSError:
+            # No hard links on this filesystem
+            await asyncio.get_running_loop().run_in_executor(None, shutil.copyfile, filename, private)
+        return private
+
+    async def extract_info(self, url: str) -> Tuple[Dict, str]:
+        now = time.monotonic()
+        cached = self.info_cache.get(url)
+        if cached and now - cached[0] < YTDL_INFO_TTL:
+            return cached[1]
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.pool, ytdl_extract, url, self.ydl_opts
+        )
+        self.info_cache = {k: v for k, v in self.info_cache.items() if now - v[0] < YTDL_INFO_TTL}
+        self.info_cache[url] = (now, result)
+        return result
+
+    async def _worker(self):
+        while True:
+            _, _, url, future = await self.queue.get()
+            try:
+                if future.done() or url in self.running:
+                    continue
+                self.running.add(url)
+                try:
+                    future.set_result(await self._run(url))
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    self.running.discard(url)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, url: str) -> str:
+        _, filename = await self.extract_info(url)
+        if not os.path.exists(filename):
+            await asyncio.get_running_loop().run_in_executor(
+                self.pool, ytdl_fetch, url, self.ydl_opts
+            )
+        return filename
+
 class MongoDB:
     """MongoDB operations handler"""
     users = db['users']
     urls = db['tracked_urls']
     sudo = db['sudo_users']
     authorized = db['authorized_chats']
+    file_ids = db['telegram_file_ids']
+    sent = db['sent_resources']
+    leases = db['shard_leases']
+    workers = db['workers']
+
+class ShardCoordinator:
+    """Splits SHARD_COUNT shards between live workers with leases in Mongo.
+
+    Every heartbeat renews this worker's liveness and leases, gives back
+    leases above its fair share (so new workers can join) and claims free
+    or expired shards up to that share. A lease that is not renewed within
+    LEASE_TTL can be claimed by another worker.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.owned = set()
+        self.live = 1  # live workers at the last heartbeat, this one included
+
+    async def heartbeat(self) -> Tuple[set, set]:
+        """Return the shards gained and lost since the previous heartbeat"""
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=LEASE_TTL)
+        await MongoDB.workers.update_one(
+            {'_id': self.worker_id}, {'$set': {'expires_at': expires}}, upsert=True
+        )
+        live = await MongoDB.workers.count_documents({'expires_at': {'$gt': now}})
+        self.live = max(live, 1)
+        share = math.ceil(SHARD_COUNT / self.live)
+
+        mine = {'owner': self.worker_id, 'expires_at': {'$gt': now}}
+        await MongoDB.leases.update_many(mine, {'$set': {'expires_at': expires}})
+        owned = {lease['_id'] async for lease in MongoDB.leases.find(mine, {'_id': 1})}
+
+        surplus = sorted(owned)[share:]
+        if surplus:
+            await MongoDB.leases.update_many(
+                {'_id': {'$in': surplus}, 'owner': self.worker_id},
+                {'$set': {'owner': None, 'expires_at': now}}
+            )
+            owned.difference_update(surplus)
+
+        free = [shard for shard in range(SHARD_COUNT) if shard not in owned]
+        random.shuffle(free)
+        for shard in free:
+            if len(owned) >= share:
+                break
+            try:
+                lease = await MongoDB.leases.find_one_and_update(
+                    {'_id': shard, '$or': [{'owner': None}, {'expires_at': {'$lte': now}}]},
+                    {'$set': {'owner': self.worker_id, 'expires_at': expires}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                continue  # held by a live worker
+            if lease:
+                owned.add(shard)
+
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = owned
+        return gained, lost
+
+    async def release(self):
+        await MongoDB.leases.update_many(
+            {'owner': self.worker_id},
+            {'$set': {'owner': None, 'expires_at': datetime.utcnow()}}
+        )
+        await MongoDB.workers.delete_one({'_id': self.worker_id})
+        self.owned = set()
+
+class AuthCache:
+    """In-process copy of sudo users and authorized chats.
+
+    Loaded at startup and reloaded every AUTH_CACHE_TTL seconds; the
+    /addsudo and /authchat handlers update it directly, so lookups never
+    touch the database.
+    """
+
+    def __init__(self):
+        self.owner_id = int(os.getenv("OWNER_ID", "0"))
+        self.sudo_users = set()
+        self.chats = set()
+
+    async def refresh(self):
+        sudo_users = {doc['user_id'] async for doc in MongoDB.sudo.find({}, {'user_id': 1})}
+        chats = {doc['chat_id'] async for doc in MongoDB.authorized.find({}, {'chat_id': 1})}
+        self.sudo_users, self.chats = sudo_users, chats
+
+    def is_owner(self, user_id: int) -> bool:
+        return user_id == self.owner_id
+
+    def is_sudo(self, user_id: int) -> bool:
+        return user_id == self.owner_id or user_id in self.sudo_users
 
 class URLTrackerBot:
     def __init__(self):
+        # Workers only send; they keep no session file and take no updates
         self.app = Client(
-            "url_tracker_bot",
+            "url_tracker_bot" if BOT_MODE != 'worker' else f"url_tracker_worker_{WORKER_ID}",
             api_id=int(os.getenv("API_ID")),
             api_hash=os.getenv("API_HASH"),
-            bot_token=os.getenv("BOT_TOKEN")
+            bot_token=os.getenv("BOT_TOKEN"),
+            in_memory=BOT_MODE == 'worker',
+            no_updates=BOT_MODE == 'worker'
         )
         self.scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-        self.http = aiohttp.ClientSession()
+        self.http: Optional[aiohttp.ClientSession] = None  # opened on the running loop in start()
+        self.host_policy = HostPolicy(float(os.getenv('HOST_MIN_DELAY', '0')))
+        self.resource_cache = ResourceCache()
+        self.fetch_pool = FetchPool()
+        self.resource_timeout = aiohttp.ClientTimeout(total=RESOURCE_TIMEOUT)
+        self.sweeper = SweepScheduler()
+        self.check_slots = asyncio.Semaphore(CHECK_WORKERS)
+        self._tasks = set()
+        self.dispatcher = NotificationDispatcher()
+        self.pending_resources = set()
+        self.auth_cache = AuthCache()
+        self.shards = ShardCoordinator()
+        self.synced_at = datetime.now()
+        self.page_cache: Dict[str, Tuple[float, Tuple, Tuple]] = {}
+        self.inflight_pages: Dict[Tuple, asyncio.Task] = {}
+        self.download_cache = DownloadCache()
+        self.uploads: Dict[Tuple[str, str], asyncio.Future] = {}  # (hash, type) -> file_id of the upload in flight
+        self.parsed_pages: OrderedDict = OrderedDict()
         self.ydl_opts = {
             'format': 'best',
             'quiet': True,
@@ -78,9 +814,27 @@ class URLTrackerBot:
             'max_filesize': MAX_FILE_SIZE,
             'outtmpl': 'downloads/%(id)s.%(ext)s'
         }
+        self.downloads = DownloadManager(self.ydl_opts)
+        self.profiler = SamplingProfiler()
+        self.metrics_runner = None
+        self.register_metrics()
         self.initialize_handlers()
         self.create_downloads_dir()
 
+    def register_metrics(self):
+        REGISTRY.gauge('tracker_send_queue_depth', 'Telegram calls waiting to be sent',
+                       lambda: self.dispatcher.pending)
+        REGISTRY.gauge('tracker_flood_waits', 'FloodWait errors since start',
+                       lambda: self.dispatcher.flood_waits)
+        REGISTRY.gauge('tracker_ytdl_queue_depth', 'yt-dlp jobs waiting for a worker process',
+                       lambda: self.downloads.queue_depth)
+        REGISTRY.gauge('tracker_sweep_queue_size', 'URLs queued in the sweep scheduler',
+                       lambda: len(self.sweeper))
+
+    def job_submitted(self, event):
+        lag = datetime.now(ZoneInfo(TIMEZONE)) - event.scheduled_run_times[0]
+        SCHEDULER_LAG.observe(max(0.0, lag.total_seconds()))
+
     def create_downloads_dir(self):
         if not os.path.exists('downloads'):
             os.makedirs('downloads')
@@ -94,86 +848,208 @@ class URLTrackerBot:
             (self.sudo_handler, 'removesudo'),
             (self.auth_handler, 'authchat'),
             (self.auth_handler, 'unauthchat'),
-            (self.documents_handler, 'documents'),
             (self.ytdl_handler, 'dl'),
+            (self.filter_handler, 'filter'),
+            (self.ignore_handler, 'ignore'),
+            (self.stats_handler, 'stats'),
             (self.start_handler, 'start'),
             (self.help_handler, 'help'),
-            (CallbackQueryHandler(self.nightmode_toggle), None),
-            (CallbackQueryHandler(self.delete_entry), None)
+            (CallbackQueryHandler(self.nightmode_toggle, filters.regex(r'^night:')), None),
+            (CallbackQueryHandler(self.delete_entry, filters.regex(r'^del:')), None)
         ]
         
         for handler, command in handlers:
             if command:
                 self.app.add_handler(MessageHandler(handler, filters.command(command)))
+            else:
+                self.app.add_handler(handler)
 
     # ------------------- Authorization ------------------- #
     async def is_authorized(self, message: Message) -> bool:
         if message.chat.type == enums.ChatType.CHANNEL:
-            return await MongoDB.authorized.find_one({'chat_id': message.chat.id})
-        return any([
-            await MongoDB.sudo.find_one({'user_id': message.from_user.id}),
-            message.from_user.id == int(os.getenv("OWNER_ID")),
-            await MongoDB.authorized.find_one({'chat_id': message.chat.id})
-        ])
+            return message.chat.id in self.auth_cache.chats
+        return (
+            self.auth_cache.is_sudo(message.from_user.id)
+            or message.chat.id in self.auth_cache.chats
+        )
+
+    async def sudo_handler(self, client: Client, message: Message):
+        """/addsudo <user_id>, /removesudo <user_id> - owner only"""
+        if not message.from_user or not self.auth_cache.is_owner(message.from_user.id):
+            return await message.reply("❌ Owner only command!")
+
+        parts = message.text.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            return await message.reply(f"Format: /{message.command[0]} <user_id>")
+
+        user_id = int(parts[1])
+        if message.command[0] == 'addsudo':
+            await MongoDB.sudo.update_one(
+                {'user_id': user_id},
+                {'$set': {'user_id': user_id, 'added_at': datetime.now()}},
+                upsert=True
+            )
+            self.auth_cache.sudo_users.add(user_id)
+            await message.reply(f"✅ Added sudo user {user_id}")
+        else:
+            await MongoDB.sudo.delete_one({'user_id': user_id})
+            self.auth_cache.sudo_users.discard(user_id)
+            await message.reply(f"✅ Removed sudo user {user_id}")
+
+    async def auth_handler(self, client: Client, message: Message):
+        """/authchat [chat_id], /unauthchat [chat_id] - owner and sudo users; defaults to this chat"""
+        if not message.from_user or not self.auth_cache.is_sudo(message.from_user.id):
+            return await message.reply("❌ Authorization failed!")
+
+        parts = message.text.split()
+        try:
+            chat_id = int(parts[1]) if len(parts) > 1 else message.chat.id
+        except ValueError:
+            return await message.reply(f"Format: /{message.command[0]} [chat_id]")
+
+        if message.command[0] == 'authchat':
+            await MongoDB.authorized.update_one(
+                {'chat_id': chat_id},
+                {'$set': {'chat_id': chat_id, 'added_at': datetime.now()}},
+                upsert=True
+            )
+            self.auth_cache.chats.add(chat_id)
+            await message.reply(f"✅ Authorized chat {chat_id}")
+        else:
+            await MongoDB.authorized.delete_one({'chat_id': chat_id})
+            self.auth_cache.chats.discard(chat_id)
+            await message.reply(f"✅ Unauthorized chat {chat_id}")
 
     # ------------------- Enhanced Web Monitoring ------------------- #
-    async def get_webpage_content(self, url: str) -> Tuple[str, List[Dict]]:
+    async def get_webpage_content(
+        self, url: str, validators: Optional[Dict] = None
+    ) -> Tuple[Optional[str], List[Dict], Dict]:
+        """Fetch a page and its resources.
+
+        Returns ``None`` as content when the server answers 304 Not Modified
+        for the given validators, so callers can end the check early.
+        """
         try:
-            async with self.http.get(url, timeout=30) as resp:
-                content = await resp.text()
-                soup = BeautifulSoup(content, 'lxml')
-                
-                resources = []
-                seen_hashes = set()
-                
-                for tag in soup.find_all(['a', 'img', 'audio', 'video', 'source']):
-                    resource_url = None
-                    if tag.name == 'a' and (href := tag.get('href')):
-                        resource_url = unquote(urljoin(url, href))
-                    elif (src := tag.get('src')):
-                        resource_url = unquote(urljoin(url, src))
-                    
-                    if resource_url:
-                        try:
-                            async with self.http.get(resource_url) as r:
-                                file_content = await r.read()
-                                file_hash = hashlib.md5(file_content).hexdigest()
-                                if file_hash in seen_hashes:
-                                    continue
-                                seen_hashes.add(file_hash)
-                        except:
-                            file_hash = hashlib.md5(resource_url.encode()).hexdigest()
-                        
-                        ext = os.path.splitext(resource_url)[1].lower()
-                        for file_type, extensions in SUPPORTED_EXTENSIONS.items():
-                            if ext in extensions:
-                                resources.append({
-                                    'url': resource_url,
-                                    'type': file_type,
-                                    'hash': file_hash
-                                })
-                                break
-                
-                return content, resources
+            with CHECK_SECONDS.time(stage='page'):
+                async with self.host_policy.request(
+                    self.http, 'GET', url, timeout=30, headers=conditional_headers(validators)
+                ) as resp:
+                    if resp.status == 304:
+                        return None, [], validators
+                    resp.raise_for_status()
+                    new_validators = extract_validators(resp.headers)
+                    FETCHED_BYTES.inc(len(await resp.read()), kind='page')
+                    content = await resp.text()
+
+            # Unchanged markup keeps the links found last time; no parse needed
+            page_hash = hashlib.md5(content.encode()).hexdigest()
+            parsed = self.parsed_pages.get(url)
+            if parsed and parsed[0] == page_hash:
+                self.parsed_pages.move_to_end(url)
+                candidates = parsed[1]
+            else:
+                with CHECK_SECONDS.time(stage='links'):
+                    candidates = extract_resource_links(content, url)
+                self.parsed_pages[url] = (page_hash, candidates)
+                self.parsed_pages.move_to_end(url)
+                while len(self.parsed_pages) > PARSED_PAGES_MAX:
+                    self.parsed_pages.popitem(last=False)
+
+            with CHECK_SECONDS.time(stage='resources'):
+                hashes = await self.fetch_pool.map(list(candidates), self.fingerprint_resource)
+
+            resources = []
+            seen_hashes = set()
+            for resource_url, file_type in candidates.items():
+                file_hash = hashes[resource_url]
+                if file_hash is None or file_hash in seen_hashes:
+                    continue
+                seen_hashes.add(file_hash)
+                resources.append({
+                    'url': resource_url,
+                    'type': file_type,
+                    'hash': file_hash
+                })
+            
+            return content, resources, new_validators
         except Exception as e:
             logger.error(f"Web monitoring error: {str(e)}")
-            return "", []
+            return "", [], validators or {}
+
+    async def fetch_page(
+        self, url: str, validators: Optional[Dict] = None
+    ) -> Tuple[Optional[str], List[Dict], Dict]:
+        """Shared get_webpage_content: one fetch per URL per SHARED_FETCH_WINDOW.
+
+        Concurrent callers wait on the same in-flight request. A full response
+        or a failure serves every subscriber, so a down page is requested once
+        per window rather than once per subscriber; a 304 only serves callers
+        that sent the same validators, since it says nothing about older copies.
+        """
+        vkey = (url,) + tuple((validators or {}).get(k) for k in ('etag', 'last_modified'))
+        cached = self.page_cache.get(url)
+        if cached and time.monotonic() - cached[0] < SHARED_FETCH_WINDOW:
+            _, cached_vkey, result = cached
+            if result[0] is not None or cached_vkey == vkey:
+                return result
+
+        task = self.inflight_pages.get(vkey)
+        if task is None:
+            task = asyncio.create_task(self.get_webpage_content(url, validators))
+            self.inflight_pages[vkey] = task
+            task.add_done_callback(lambda t: self._page_fetched(url, vkey, t))
+        return await asyncio.shield(task)
+
+    def _page_fetched(self, url: str, vkey: Tuple, task: asyncio.Task):
+        self.inflight_pages.pop(vkey, None)
+        if task.cancelled() or task.exception():
+            return
+        now = time.monotonic()
+        if len(self.page_cache) >= PAGE_CACHE_MAX:
+            self.page_cache = {
+                k: v for k, v in self.page_cache.items()
+                if now - v[0] < SHARED_FETCH_WINDOW
+            }
+        self.page_cache[url] = (now, vkey, task.result())
+
+    async def fingerprint_resource(self, resource_url: str) -> Optional[str]:
+        """Return the content hash of a resource, downloading it only when new or changed.
+
+        When the resource cannot be reached the last known hash is reused, and
+        a resource never hashed before gives None so the check leaves it out.
+        """
+        entry = self.resource_cache.get(resource_url)
+        if entry and self.resource_cache.is_fresh(entry):
+            return entry['hash']
 
-    # ------------------- YT-DLP Enhanced Integration ------------------- #
-    async def ytdl_download(self, url: str) -> Optional[str]:
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                
-                if 'entries' in info:
-                    info = info['entries'][0]
+            if entry:
+                async with self.host_policy.request(
+                    self.http, 'HEAD', resource_url, allow_redirects=True, timeout=self.resource_timeout
+                ) as r:
+                    if r.status == 200 and same_resource(entry['validators'], extract_validators(r.headers)):
+                        self.resource_cache.touch(resource_url)
+                        return entry['hash']
 
-                filename = ydl.prepare_filename(info)
-                if os.path.exists(filename):
-                    return filename
-                
-                await asyncio.to_thread(ydl.download, [url])
-                return filename
+            async with self.host_policy.request(
+                self.http, 'GET', resource_url, timeout=self.resource_timeout
+            ) as r:
+                r.raise_for_status()
+                digest = hashlib.md5()
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    digest.update(chunk)
+                    FETCHED_BYTES.inc(len(chunk), kind='resource')
+                file_hash = digest.hexdigest()
+                self.resource_cache.put(resource_url, file_hash, extract_validators(r.headers))
+                return file_hash
+        except Exception:
+            return entry['hash'] if entry else None
+
+    # ------------------- YT-DLP Enhanced Integration ------------------- #
+    async def ytdl_download(self, url: str, priority: int = PRIORITY_TRACKING) -> Optional[str]:
+        try:
+            with YTDL_SECONDS.time():
+                return await self.downloads.download(url, priority)
         except yt_dlp.utils.DownloadError as e:
             logger.error(f"YT-DLP Download Error: {str(e)}")
             return await self.direct_download(url)
@@ -182,81 +1058,353 @@ class URLTrackerBot:
             return None
 
     async def direct_download(self, url: str) -> Optional[str]:
+        """Stream a file to disk, hashing as it goes and stopping at MAX_FILE_SIZE"""
+        tmp_name = None
         try:
-            async with self.http.get(url) as resp:
+            async with self.host_policy.request(self.http, 'GET', url) as resp:
                 if resp.status != 200:
                     return None
-                
-                content = await resp.read()
-                if len(content) > MAX_FILE_SIZE:
+                if resp.content_length and resp.content_length > MAX_FILE_SIZE:
+                    logger.warning(f"File too big: {resp.content_length} bytes")
                     return None
-                
+
                 file_ext = os.path.splitext(url)[1].split('?')[0][:4]
-                file_name = f"downloads/{hashlib.md5(content).hexdigest()}{file_ext}"
-                
-                async with aiofiles.open(file_name, 'wb') as f:
-                    await f.write(content)
-                
-                return file_name
+                tmp_name = f"downloads/{uuid.uuid4().hex}.part"
+                digest = hashlib.md5()
+                size = 0
+                async with aiofiles.open(tmp_name, 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > MAX_FILE_SIZE:
+                            logger.warning(f"File too big: more than {MAX_FILE_SIZE} bytes")
+                            return None
+                        digest.update(chunk)
+                        await f.write(chunk)
+                        FETCHED_BYTES.inc(len(chunk), kind='download')
+
+            file_name = f"downloads/{digest.hexdigest()}{file_ext}"
+            await async_os.replace(tmp_name, file_name)
+            tmp_name = None
+            return file_name
         except Exception as e:
             logger.error(f"Direct download failed: {str(e)}")
             return None
+        finally:
+            if tmp_name and os.path.exists(tmp_name):
+                await async_os.remove(tmp_name)
+
+    async def download_resource(self, url: str) -> Optional[str]:
+        file_path = await self.ytdl_download(url)
+        if not file_path:
+            file_path = await self.direct_download(url)
+        if not file_path:
+            return None
+
+        file_size = os.path.getsize(file_path)
+        if file_size > MAX_FILE_SIZE:
+            logger.warning(f"File too big: {file_size} bytes")
+            await async_os.remove(file_path)
+            return None
+        return file_path
 
     # ------------------- Message Handling ------------------- #
-    async def safe_send_message(self, user_id: int, text: str, **kwargs):
-        try:
-            if len(text) <= MAX_MESSAGE_LENGTH:
-                await self.app.send_message(user_id, text, **kwargs)
-            else:
-                parts = [text[i:i+MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]
-                for part in parts:
-                    await self.app.send_message(user_id, part, **kwargs)
-                    await asyncio.sleep(1)
-        except Exception as e:
-            logger.error(f"Message sending failed: {str(e)}")
+    def safe_send_message(self, user_id: int, text: str, **kwargs):
+        """Queue a text message, split into MAX_MESSAGE_LENGTH parts"""
+        for i in range(0, len(text), MAX_MESSAGE_LENGTH):
+            part = text[i:i+MAX_MESSAGE_LENGTH]
+            self.dispatcher.post(
+                user_id,
+                lambda part=part: self.app.send_message(user_id, part, **kwargs)
+            )
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
 
     # ------------------- Tracking Core Logic ------------------- #
-    async def check_updates(self, user_id: int, url: str):
+    async def check_updates(self, user_id: int, url: str, tracked_data: Optional[Dict] = None):
+        started = time.perf_counter()
         try:
-            tracked_data = await MongoDB.urls.find_one({'user_id': user_id, 'url': url})
+            if tracked_data is None:
+                tracked_data = await MongoDB.urls.find_one({'user_id': user_id, 'url': url})
             if not tracked_data:
                 return
 
-            current_content, new_resources = await self.get_webpage_content(url)
-            previous_hash = tracked_data.get('content_hash', '')
-            current_hash = hashlib.md5(current_content.encode()).hexdigest()
-            
-            if current_hash != previous_hash or new_resources:
-                text_changes = f"🔄 Website Updated: {url}\n" + \
-                             f"📅 Change detected at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                             
-                await self.safe_send_message(user_id, text_changes)
-
-                sent_hashes = []
-                for resource in new_resources:
-                    if resource['hash'] not in tracked_data.get('sent_hashes', []):
-                        if await self.send_media(user_id, resource, tracked_data):
-                            sent_hashes.append(resource['hash'])
-                
-                update_data = {
-                    'content_hash': current_hash,
-                    'last_checked': datetime.now()
-                }
-                
-                if sent_hashes:
-                    update_data['$push'] = {'sent_hashes': {'$each': sent_hashes}}
-                
+            # Chronically failing URLs skip checks until their stretched interval is up
+            factor = backoff_factor(tracked_data.get('fail_count', 0))
+            last_checked = tracked_data.get('last_checked')
+            if factor > 1 and last_checked and \
+                    datetime.now() - last_checked < timedelta(minutes=tracked_data['interval'] * (factor - 0.5)):
+                CHECKS.inc(result='skipped')
+                return
+
+            # Without a snapshot a 304 would never let a new baseline be recorded
+            with CHECK_SECONDS.time(stage='fetch'):
+                current_content, new_resources, validators = await self.fetch_page(
+                    url, tracked_data.get('validators') if 'snapshot' in tracked_data else None
+                )
+            if current_content == "":
+                CHECKS.inc(result='failed')
+                await MongoDB.urls.update_one(
+                    {'_id': tracked_data['_id']},
+                    {'$set': {'last_checked': datetime.now()}, '$inc': {'fail_count': 1}}
+                )
+                return
+
+            update_data = {
+                'last_checked': datetime.now(),
+                'validators': validators
+            }
+            if tracked_data.get('fail_count'):
+                update_data['fail_count'] = 0
+
+            # 304 Not Modified: nothing to parse or hash
+            if current_content is None:
+                CHECKS.inc(result='not_modified')
                 await MongoDB.urls.update_one(
                     {'_id': tracked_data['_id']},
                     {'$set': update_data}
                 )
+                return
+
+            # Compare main text blocks and links, not raw markup; without an
+            # earlier snapshot (old documents, changed rules) only set a baseline
+            with CHECK_SECONDS.time(stage='snapshot'):
+                snapshot, changes = await build_snapshot(
+                    current_content,
+                    url,
+                    tracked_data.get('selector'),
+                    tuple(tracked_data.get('ignore_patterns', [])),
+                    tracked_data.get('snapshot')
+                )
+            current_hash = snapshot['hash']
+            if current_hash != tracked_data.get('content_hash', '') or 'snapshot' not in tracked_data:
+                update_data['content_hash'] = current_hash
+                update_data['snapshot'] = compact(snapshot)
+
+            # Record first: the compare-and-set on content_hash lets only one
+            # process (e.g. a worker taking over a shard) announce a change
+            query = {'_id': tracked_data['_id']}
+            if 'content_hash' in update_data:
+                query['content_hash'] = tracked_data.get('content_hash')
+            with CHECK_SECONDS.time(stage='store'):
+                result = await MongoDB.urls.update_one(query, {'$set': update_data})
+            if not result.matched_count:
+                CHECKS.inc(result='superseded')
+                return
+            CHECKS.inc(result='changed' if has_changes(changes) else 'unchanged')
+
+            sent = await self.load_sent_hashes(tracked_data, [r['hash'] for r in new_resources])
+            unsent = [
+                resource for resource in new_resources
+                if resource['hash'] not in sent
+                and (tracked_data['_id'], resource['hash']) not in self.pending_resources
+            ]
+
+            text_changes = f"🔄 Website Updated: {url}\n" + \
+                         f"📅 Change detected at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            if has_changes(changes):
+                # Scraped text and URLs must go out verbatim, not as Markdown/HTML
+                self.safe_send_message(
+                    user_id, text_changes + "\n" + format_changes(changes),
+                    parse_mode=enums.ParseMode.DISABLED
+                )
+
+            # Media goes out in the background so this check never waits on Telegram;
+            # without a text change the header waits for the first claimed resource
+            if unsent:
+                self.pending_resources.update((tracked_data['_id'], r['hash']) for r in unsent)
+                self.spawn(self.deliver_resources(
+                    user_id, tracked_data, unsent,
+                    None if has_changes(changes) else text_changes
+                ))
                 
         except Exception as e:
+            CHECKS.inc(result='error')
             logger.error(f"Update check failed for {url}: {str(e)}")
-            await self.app.send_message(user_id, f"⚠️ Error checking updates for {url}")
+            self.safe_send_message(user_id, f"⚠️ Error checking updates for {url}")
+        finally:
+            CHECK_SECONDS.observe(time.perf_counter() - started, stage='total')
+
+    async def deliver_resources(
+        self, user_id: int, tracked_data: Dict, resources: List[Dict], header: Optional[str] = None
+    ):
+        try:
+            for resource in resources:
+                # Claim the resource before sending so no other process sends it too;
+                # the claim is dropped again if sending fails
+                try:
+                    claim = await MongoDB.sent.update_one(
+                        {'url_id': tracked_data['_id'], 'hash': resource['hash']},
+                        {'$setOnInsert': {'sent_at': datetime.now()}},
+                        upsert=True
+                    )
+                except DuplicateKeyError:
+                    continue
+                if claim.upserted_id is None:
+                    continue
+                if header:
+                    self.safe_send_message(user_id, header, parse_mode=enums.ParseMode.DISABLED)
+                    header = None
+                if not await self.send_media(user_id, resource, tracked_data):
+                    await MongoDB.sent.delete_one({'_id': claim.upserted_id})
+        except Exception as e:
+            logger.error(f"Resource delivery failed for {tracked_data['url']}: {str(e)}")
+        finally:
+            for resource in resources:
+                self.pending_resources.discard((tracked_data['_id'], resource['hash']))
+
+    async def load_sent_hashes(self, tracked_data: Dict, hashes: List[str]) -> set:
+        """Return which of the given resource hashes were already sent for this URL"""
+        sent = set()
+        # Older documents carry an unbounded sent_hashes array; move it out once
+        if legacy := tracked_data.get('sent_hashes'):
+            await self.record_sent(tracked_data['_id'], legacy)
+            await MongoDB.urls.update_one({'_id': tracked_data['_id']}, {'$unset': {'sent_hashes': ''}})
+            sent.update(set(legacy).intersection(hashes))
+
+        if not hashes:
+            return sent
+        async for doc in MongoDB.sent.find(
+            {'url_id': tracked_data['_id'], 'hash': {'$in': hashes}},
+            {'hash': 1, '_id': 0}
+        ):
+            sent.add(doc['hash'])
+        return sent
+
+    async def record_sent(self, url_id, hashes: List[str]):
+        if not hashes:
+            return
+        now = datetime.now()
+        await MongoDB.sent.bulk_write([
+            UpdateOne({'url_id': url_id, 'hash': h}, {'$setOnInsert': {'sent_at': now}}, upsert=True)
+            for h in hashes
+        ], ordered=False)
+
+    # ------------------- Scheduling ------------------- #
+    def schedule_tracking(self, tracked_data: Dict, first_run: Optional[float] = None):
+        if BOT_MODE == 'frontend':
+            return  # picked up by the worker holding the URL's shard
+        if SCHEDULER_MODE == 'sweep' or BOT_MODE == 'worker':
+            self.sweeper.add(tracked_data['_id'], tracked_data['interval'], first_run)
+            return
+
+        # Night mode is checked when the job runs: an AndTrigger of this interval
+        # and an on-the-hour cron almost never coincides and spins forever
+        trigger = IntervalTrigger(
+            minutes=tracked_data['interval'],
+            start_date=datetime.fromtimestamp(first_run).astimezone() if first_run else None
+        )
+        self.scheduler.add_job(
+            self.scheduled_check,
+            trigger=trigger,
+            args=[tracked_data['user_id'], tracked_data['url'], bool(tracked_data.get('night_mode'))],
+            id=tracking_job_id(tracked_data),
+            max_instances=2,
+            replace_existing=True
+        )
+
+    def unschedule_tracking(self, tracked_data: Dict):
+        if BOT_MODE == 'frontend':
+            return  # the worker's sweep drops URLs that no longer exist
+        if SCHEDULER_MODE == 'sweep' or BOT_MODE == 'worker':
+            self.sweeper.remove(tracked_data['_id'])
+            return
+        try:
+            self.scheduler.remove_job(tracking_job_id(tracked_data))
+        except JobLookupError:
+            pass
+
+    async def untrack(self, user_id: int, url_id) -> Optional[Dict]:
+        """Stop tracking one of the user's URLs; returns the removed document"""
+        tracked_data = await MongoDB.urls.find_one_and_delete({'_id': url_id, 'user_id': user_id})
+        if tracked_data:
+            self.unschedule_tracking(tracked_data)
+            await MongoDB.sent.delete_many({'url_id': url_id})
+        return tracked_data
+
+    async def restore_schedules(self):
+        """Rebuild every tracking schedule from Mongo after a restart"""
+        now = time.time()
+        count = 0
+        async for tracked_data in MongoDB.urls.find({}, SCHEDULE_FIELDS, batch_size=1000):
+            self.schedule_tracking(tracked_data, first_due(tracked_data, now))
+            count += 1
+        logger.info(f"Restored {count} tracked URLs")
+
+    async def sweep(self):
+        """Load every due URL with one query and hand them to the check workers"""
+        due_ids = self.sweeper.pop_due()
+        if not due_ids:
+            return
+        SCHEDULER_LAG.observe(self.sweeper.lag)
+
+        # Untracked URLs, and URLs in shards this worker lost, are simply
+        # missing here and drop out of the queue
+        query = {'_id': {'$in': due_ids}}
+        if BOT_MODE == 'worker':
+            query['shard'] = {'$in': list(self.shards.owned)}
+        try:
+            due_docs = await MongoDB.urls.find(query).to_list(None)
+        except Exception as e:
+            # Popped ids exist nowhere else; without this they would never run again
+            logger.error(f"Sweep query failed, retrying {len(due_ids)} URLs: {str(e)}")
+            self.sweeper.retry(due_ids, SWEEP_TICK)
+            return
+        for tracked_data in due_docs:
+            self.spawn(self.sweep_check(tracked_data))
+
+    async def sweep_check(self, tracked_data: Dict):
+        try:
+            async with self.check_slots:
+                if not night_paused(tracked_data.get('night_mode')):
+                    await self.check_updates(tracked_data['user_id'], tracked_data['url'], tracked_data)
+        finally:
+            self.sweeper.reschedule(tracked_data['_id'], tracked_data['interval'])
+
+    async def scheduled_check(self, user_id: int, url: str, night_mode: bool = False):
+        if not night_paused(night_mode):
+            await self.check_updates(user_id, url)
+
+    async def heartbeat(self):
+        """Worker mode: renew shard leases and queue URLs from newly held shards"""
+        try:
+            gained, lost = await self.shards.heartbeat()
+        except Exception as e:
+            logger.error(f"Shard heartbeat failed: {str(e)}")
+            return
+        # Every worker sends as the same bot, so they share its rate limit
+        self.dispatcher.set_global_rate(GLOBAL_SEND_RATE / self.shards.live)
+        if gained or lost:
+            logger.info(f"Worker {WORKER_ID}: +{len(gained)} -{len(lost)} shards, holding {len(self.shards.owned)}")
+
+        # URLs tracked since the last sync; the margin covers clock skew between hosts
+        synced_at, self.synced_at = self.synced_at, datetime.now()
+        query = {'$or': [
+            {'shard': {'$in': list(gained)}},
+            {'shard': {'$in': list(self.shards.owned)},
+             'created_at': {'$gte': synced_at - timedelta(seconds=LEASE_TTL)}}
+        ]}
+        now = time.time()
+        async for tracked_data in MongoDB.urls.find(query, SCHEDULE_FIELDS, batch_size=1000):
+            if tracked_data['_id'] not in self.sweeper:
+                self.sweeper.add(tracked_data['_id'], tracked_data['interval'], first_due(tracked_data, now))
+
+    async def backfill_shards(self):
+        """Give documents created before sharding their shard number"""
+        updates = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {'shard': shard_of(doc['url'])}})
+            async for doc in MongoDB.urls.find({'shard': {'$exists': False}}, {'url': 1})
+        ]
+        if updates:
+            await MongoDB.urls.bulk_write(updates, ordered=False)
 
     # ------------------- Media Sending ------------------- #
     async def send_media(self, user_id: int, resource: Dict, tracked_data: Dict) -> bool:
+        started = time.perf_counter()
+        path = 'file_id'
         try:
             caption = (
                 f"📁 {tracked_data.get('name', 'Unnamed')}\n"
@@ -264,18 +1412,6 @@ class URLTrackerBot:
                 f"📥 Direct URL: {resource['url']}"
             )
             
-            file_path = await self.ytdl_download(resource['url'])
-            if not file_path:
-                file_path = await self.direct_download(resource['url'])
-            
-            if not file_path:
-                return False
-
-            file_size = os.path.getsize(file_path)
-            if file_size > MAX_FILE_SIZE:
-                logger.warning(f"File too big: {file_size} bytes")
-                return False
-
             send_methods = {
                 'pdf': self.app.send_document,
                 'image': self.app.send_photo,
@@ -284,19 +1420,69 @@ class URLTrackerBot:
             }
             
             method = send_methods.get(resource['type'], self.app.send_document)
-            await method(
-                user_id,
-                file_path,
-                caption=caption[:1024],
-                parse_mode=enums.ParseMode.HTML
-            )
-            
-            await async_os.remove(file_path)
-            return True
+            cache_key = {'hash': resource['hash'], 'type': resource['type']}
+            upload_key = (resource['hash'], resource['type'])
+
+            cached = await MongoDB.file_ids.find_one(cache_key)
+            file_id = cached['file_id'] if cached else None
+            # Subscribers fanned out together all miss the cache; wait for the first upload
+            while not file_id and upload_key in self.uploads:
+                file_id = await asyncio.shield(self.uploads[upload_key])
+
+            # Re-send an earlier upload by file_id: no download, no upload
+            if file_id:
+                try:
+                    await self.dispatcher.send(user_id, lambda: method(
+                        user_id,
+                        file_id,
+                        caption=caption[:1024],
+                        parse_mode=enums.ParseMode.HTML
+                    ))
+                    return True
+                except (FileIdInvalid, FileReferenceExpired, MediaEmpty) as e:
+                    # Only a stale file reference invalidates the shared entry;
+                    # anything else (blocked bot, flood) is about this recipient
+                    logger.warning(f"Cached file_id rejected, uploading again: {str(e)}")
+                    await MongoDB.file_ids.delete_one({**cache_key, 'file_id': file_id})
+
+            path = 'upload'
+            upload = None
+            if upload_key not in self.uploads:
+                upload = self.uploads[upload_key] = asyncio.get_running_loop().create_future()
+            file_id = None
+            try:
+                async with self.download_cache.acquire(
+                    resource['url'], resource['hash'], self.download_resource
+                ) as file_path:
+                    if not file_path:
+                        return False
+
+                    sent = await self.dispatcher.send(user_id, lambda: method(
+                        user_id,
+                        file_path,
+                        caption=caption[:1024],
+                        parse_mode=enums.ParseMode.HTML
+                    ))
+
+                if file_id := uploaded_file_id(sent):
+                    await MongoDB.file_ids.update_one(
+                        cache_key,
+                        {'$set': {'file_id': file_id, 'url': resource['url'], 'created_at': datetime.now()}},
+                        upsert=True
+                    )
+                return True
+            finally:
+                # Waiters get None after a failed upload and upload themselves, one at a time
+                if upload is not None:
+                    del self.uploads[upload_key]
+                    upload.set_result(file_id)
             
         except Exception as e:
             logger.error(f"Media send failed: {str(e)}")
+            path = 'failed'
             return False
+        finally:
+            SEND_SECONDS.observe(time.perf_counter() - started, path=path)
 
     # ------------------- Command Handlers ------------------- #
     async def track_handler(self, client: Client, message: Message):
@@ -317,49 +1503,232 @@ class URLTrackerBot:
             if tracked_count >= MAX_TRACKED_PER_USER:
                 return await message.reply(f"❌ Tracking limit reached ({MAX_TRACKED_PER_USER} URLs)")
 
-            content, _ = await self.get_webpage_content(url)
+            content, _, validators = await self.get_webpage_content(url)
             if not content:
                 return await message.reply("❌ Invalid URL or unable to access")
 
-            await MongoDB.urls.update_one(
+            snapshot, _ = await build_snapshot(content, url)
+            tracked_data = await MongoDB.urls.find_one_and_update(
                 {'user_id': message.from_user.id, 'url': url},
                 {'$set': {
                     'name': name,
                     'interval': interval,
                     'night_mode': night_mode,
-                    'content_hash': hashlib.md5(content.encode()).hexdigest(),
-                    'sent_hashes': [],
+                    'shard': shard_of(url),
+                    'content_hash': snapshot['hash'],
+                    'snapshot': compact(snapshot),
+                    'validators': validators,
                     'created_at': datetime.now()
-                }},
-                upsert=True
+                }, '$unset': {'sent_hashes': ''}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
+            # Tracking (again) starts with nothing sent
+            await MongoDB.sent.delete_many({'url_id': tracked_data['_id']})
+            self.schedule_tracking(tracked_data)
 
-            trigger = IntervalTrigger(minutes=interval)
-            if night_mode:
-                trigger = AndTrigger([
-                    trigger,
-                    CronTrigger(hour='6-22', timezone=TIMEZONE)
-                ])
+            await message.reply(f"✅ Tracking started for {name}\nURL: {url}")
 
-            self.scheduler.add_job(
-                self.check_updates,
-                trigger=trigger,
-                args=[message.from_user.id, url],
-                id=f"{message.from_user.id}_{hashlib.md5(url.encode()).hexdigest()}",
-                max_instances=2
+        except Exception as e:
+            await message.reply(f"❌ Error: {str(e)}")
+
+    async def untrack_handler(self, client: Client, message: Message):
+        """/untrack <url> - stop tracking a URL"""
+        if not await self.is_authorized(message):
+            return await message.reply("❌ Authorization failed!")
+
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            return await message.reply("Format: /untrack <url>")
+
+        tracked_data = await MongoDB.urls.find_one(
+            {'user_id': message.from_user.id, 'url': parts[1].strip()}, {'_id': 1}
+        )
+        if not tracked_data or not await self.untrack(message.from_user.id, tracked_data['_id']):
+            return await message.reply("❌ URL is not tracked")
+        await message.reply(f"✅ Tracking stopped for {parts[1].strip()}")
+
+    async def list_handler(self, client: Client, message: Message):
+        """/list - tracked URLs with night mode and delete buttons"""
+        if not await self.is_authorized(message):
+            return await message.reply("❌ Authorization failed!")
+
+        tracked = await MongoDB.urls.find(
+            {'user_id': message.from_user.id},
+            {'name': 1, 'url': 1, 'interval': 1, 'night_mode': 1}
+        ).to_list(MAX_TRACKED_PER_USER)
+        if not tracked:
+            return await message.reply("📭 No tracked URLs")
+
+        lines, buttons = ["📋 Tracked URLs"], []
+        for i, tracked_data in enumerate(tracked, 1):
+            night = '🌙' if tracked_data.get('night_mode') else '☀️'
+            lines.append(
+                f"{i}. {tracked_data.get('name', 'Unnamed')} {night} every {tracked_data['interval']} min\n"
+                f"   {tracked_data['url']}"
             )
+            buttons.append([
+                InlineKeyboardButton(f"{i}. {night} Night mode", callback_data=f"night:{tracked_data['_id']}"),
+                InlineKeyboardButton(f"{i}. 🗑 Delete", callback_data=f"del:{tracked_data['_id']}")
+            ])
+        await message.reply(
+            '\n'.join(lines),
+            reply_markup=InlineKeyboardMarkup(buttons),
+            disable_web_page_preview=True
+        )
 
-            await message.reply(f"✅ Tracking started for {name}\nURL: {url}")
+    async def own_entry(self, query: CallbackQuery) -> Optional[Dict]:
+        """The tracked URL a /list button points at, if it belongs to whoever pressed it"""
+        try:
+            url_id = ObjectId(query.data.split(':', 1)[1])
+        except InvalidId:
+            return None
+        return await MongoDB.urls.find_one({'_id': url_id, 'user_id': query.from_user.id})
 
+    async def nightmode_toggle(self, client: Client, query: CallbackQuery):
+        tracked_data = await self.own_entry(query)
+        if not tracked_data:
+            return await query.answer("❌ URL is not tracked", show_alert=True)
+
+        night_mode = not tracked_data.get('night_mode')
+        await MongoDB.urls.update_one({'_id': tracked_data['_id']}, {'$set': {'night_mode': night_mode}})
+        # Sweep checks read night_mode from the document; only APScheduler jobs carry it
+        if BOT_MODE == 'standalone' and SCHEDULER_MODE != 'sweep':
+            self.schedule_tracking({**tracked_data, 'night_mode': night_mode})
+        await query.answer(f"Night mode {'on' if night_mode else 'off'}: {tracked_data.get('name', 'Unnamed')}")
+
+    async def delete_entry(self, client: Client, query: CallbackQuery):
+        tracked_data = await self.own_entry(query)
+        if not tracked_data or not await self.untrack(query.from_user.id, tracked_data['_id']):
+            return await query.answer("❌ URL is not tracked", show_alert=True)
+        await query.answer(f"🗑 Stopped tracking {tracked_data.get('name', 'Unnamed')}")
+
+    async def ytdl_handler(self, client: Client, message: Message):
+        """/dl <url> - download a video or file and send it here, ahead of tracking downloads"""
+        if not await self.is_authorized(message):
+            return await message.reply("❌ Authorization failed!")
+
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            return await message.reply("Format: /dl <url>")
+
+        url = parts[1].strip()
+        status = await message.reply(f"⏳ Queued ({self.downloads.queue_depth} ahead)")
+        file_path = await self.ytdl_download(url, PRIORITY_COMMAND)
+        if not file_path:
+            return await status.edit_text("❌ Download failed")
+
+        try:
+            if os.path.getsize(file_path) > MAX_FILE_SIZE:
+                return await status.edit_text("❌ File too big")
+            await self.dispatcher.send(message.chat.id, lambda: self.app.send_document(
+                message.chat.id,
+                file_path,
+                caption=f"📥 {url}"[:1024]
+            ))
+            await status.delete()
         except Exception as e:
-            await message.reply(f"❌ Error: {str(e)}")
+            await status.edit_text(f"❌ Error: {str(e)}")
+        finally:
+            if os.path.exists(file_path):
+                await async_os.remove(file_path)
+
+    async def filter_handler(self, client: Client, message: Message):
+        """/filter <url> [css selector] - only watch the matching part of a page"""
+        if not await self.is_authorized(message):
+            return await message.reply("❌ Authorization failed!")
+
+        parts = message.text.split(maxsplit=2)
+        if len(parts) < 2:
+            return await message.reply("Format: /filter <url> [css selector]")
+
+        url = parts[1]
+        selector = parts[2].strip() if len(parts) > 2 else None
+        if selector:
+            try:
+                BeautifulSoup('', 'lxml').select(selector)
+            except Exception as e:
+                return await message.reply(f"❌ Invalid selector: {str(e)}")
+
+        # New rules start a new baseline instead of reporting a diff
+        result = await MongoDB.urls.update_one(
+            {'user_id': message.from_user.id, 'url': url},
+            {'$set': {'selector': selector}, '$unset': {'snapshot': ''}}
+        )
+        if not result.matched_count:
+            return await message.reply("❌ URL is not tracked")
+        await message.reply(f"✅ Selector set: {selector}" if selector else "✅ Selector cleared")
+
+    async def ignore_handler(self, client: Client, message: Message):
+        """/ignore <url> [regex] - strip matching text before comparing; no regex clears the list"""
+        if not await self.is_authorized(message):
+            return await message.reply("❌ Authorization failed!")
+
+        parts = message.text.split(maxsplit=2)
+        if len(parts) < 2:
+            return await message.reply("Format: /ignore <url> [regex]")
+
+        url = parts[1]
+        if len(parts) > 2:
+            try:
+                re.compile(parts[2])
+            except re.error as e:
+                return await message.reply(f"❌ Invalid pattern: {str(e)}")
+            update = {'$addToSet': {'ignore_patterns': parts[2]}, '$unset': {'snapshot': ''}}
+        else:
+            update = {'$unset': {'ignore_patterns': '', 'snapshot': ''}}
+
+        result = await MongoDB.urls.update_one({'user_id': message.from_user.id, 'url': url}, update)
+        if not result.matched_count:
+            return await message.reply("❌ URL is not tracked")
+        await message.reply(f"✅ Ignoring: {parts[2]}" if len(parts) > 2 else "✅ Ignore patterns cleared")
+
+    async def stats_handler(self, client: Client, message: Message):
+        """/stats - owner only; /stats profile on|off toggles the sampling profiler"""
+        if not message.from_user or not self.auth_cache.is_owner(message.from_user.id):
+            return await message.reply("❌ Owner only command!")
+
+        parts = message.text.split()
+        if len(parts) > 1 and parts[1] == 'profile':
+            if len(parts) > 2 and parts[2] == 'on':
+                self.profiler.start()
+                return await message.reply("🔬 Profiler started")
+            self.profiler.stop()
+            return await message.reply(f"🔬 Profile ({self.profiler.total} samples)\n\n{self.profiler.report()}"[:MAX_MESSAGE_LENGTH])
+
+        def timing(histogram, **labels) -> str:
+            if not histogram.count(**labels):
+                return "n/a"
+            return f"p50 ≤{histogram.quantile(0.5, **labels):g}s p99 ≤{histogram.quantile(0.99, **labels):g}s ({histogram.count(**labels)})"
+
+        checks = ', '.join(f"{dict(key)['result']}={int(value)}" for key, value in sorted(CHECKS.values.items()))
+        fetched = sum(FETCHED_BYTES.values.values()) / (1024 * 1024)
+        lines = [
+            f"📊 Stats ({BOT_MODE}, {SCHEDULER_MODE})",
+            f"Checks: {checks or 'none'}",
+            f"Check total: {timing(CHECK_SECONDS, stage='total')}",
+            f"Page fetch: {timing(CHECK_SECONDS, stage='page')}",
+            f"Snapshot: {timing(CHECK_SECONDS, stage='snapshot')}",
+            f"Media send: {timing(SEND_SECONDS, path='upload')}",
+            f"yt-dlp: {timing(YTDL_SECONDS)}",
+            f"Scheduler lag: {timing(SCHEDULER_LAG)}",
+            f"Fetched: {fetched:.1f} MB",
+            f"Send queue: {self.dispatcher.pending}, FloodWaits: {self.dispatcher.flood_waits}",
+            f"yt-dlp queue: {self.downloads.queue_depth}",
+            f"Profiler: {'on' if self.profiler.running else 'off'}"
+        ]
+        await message.reply('\n'.join(lines))
 
     async def start_handler(self, client: Client, message: Message):
         await message.reply(
             "🤖 URL Tracker Bot\n\n"
             "Commands:\n"
             "/track <name> <url> <interval> [night] - Start tracking\n"
+            "/untrack <url> - Stop tracking\n"
             "/list - Show tracked URLs\n"
+            "/dl <url> - Download a file or video\n"
+            "/filter <url> [css selector] - Watch only part of a page\n"
+            "/ignore <url> [regex] - Ignore changing text such as timestamps\n"
             "/help - Show help menu"
         )
 
@@ -376,21 +1745,71 @@ class URLTrackerBot:
 
     # ------------------- Lifecycle Management ------------------- #
     async def start(self):
+        await MongoDB.file_ids.create_index([('hash', 1), ('type', 1)], unique=True)
+        await MongoDB.sent.create_index([('url_id', 1), ('hash', 1)], unique=True)
+        await MongoDB.urls.create_index('shard')
+        await self.backfill_shards()
+        await self.auth_cache.refresh()
+        self.http = aiohttp.ClientSession(
+            connector=make_connector(FETCH_CONCURRENCY + CHECK_WORKERS, FETCH_PER_HOST)
+        )
         await self.app.start()
+        self.dispatcher.start()
+        self.downloads.start()
+        self.scheduler.add_job(
+            self.auth_cache.refresh,
+            IntervalTrigger(seconds=AUTH_CACHE_TTL),
+            id='auth_refresh',
+            max_instances=1
+        )
+        if BOT_MODE == 'standalone':
+            await self.restore_schedules()
+        if BOT_MODE == 'worker':
+            await self.heartbeat()
+            self.scheduler.add_job(
+                self.heartbeat,
+                IntervalTrigger(seconds=HEARTBEAT_INTERVAL),
+                id='heartbeat',
+                max_instances=1
+            )
+        if BOT_MODE == 'worker' or (BOT_MODE == 'standalone' and SCHEDULER_MODE == 'sweep'):
+            self.scheduler.add_job(
+                self.sweep,
+                IntervalTrigger(seconds=SWEEP_TICK),
+                id='sweep',
+                max_instances=1,
+                coalesce=True
+            )
+        elif BOT_MODE == 'standalone':
+            self.scheduler.add_listener(self.job_submitted, EVENT_JOB_SUBMITTED)
+        if METRICS_PORT:
+            self.metrics_runner = await serve_metrics(METRICS_PORT)
         self.scheduler.start()
-        logger.info("Bot started successfully")
-        await self.app.send_message(int(os.getenv("OWNER_ID")), "🤖 Bot Started Successfully")
+        logger.info(f"Bot started successfully ({BOT_MODE})")
+        if BOT_MODE != 'worker':
+            await self.app.send_message(self.auth_cache.owner_id, "🤖 Bot Started Successfully")
 
     async def stop(self):
-        await self.app.stop()
-        await self.http.close()
         self.scheduler.shutdown()
+        self.profiler.stop()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        if BOT_MODE == 'worker':
+            await self.shards.release()
+        await self.dispatcher.stop()
+        await self.downloads.stop()
+        await self.app.stop()
+        if self.http:
+            await self.http.close()
         logger.info("Bot stopped gracefully")
 
-if __name__ == "__main__":
+async def main():
     bot = URLTrackerBot()
+    await bot.start()
     try:
-        asyncio.run(bot.start())
-        asyncio.get_event_loop().run_forever()
-    except KeyboardInterrupt:
-        asyncio.run(bot.stop())
\ No newline at end of file
+        await idle()
+    finally:
+        await bot.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
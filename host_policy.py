@@ -0,0 +1,146 @@
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+MIN_HOST_DELAY = 0.0  # seconds between request starts to a healthy host
+MAX_HOST_DELAY = 600.0
+BACKOFF_BASE = 1.0  # first delay after a host starts failing
+MAX_PACING_WAIT = 5.0  # longest a request waits for its turn; beyond that it is deferred
+SLOW_RESPONSE = 10.0  # seconds to headers that count as the host struggling
+BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+HOSTS_MAX = 4096
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+FAIL_GRACE = 2  # failed checks in a row before a URL's interval is lengthened
+MAX_BACKOFF_FACTOR = 16
+
+def make_connector(limit: int, per_host: int) -> aiohttp.TCPConnector:
+    """Keep-alive pool with cached DNS and a cap on connections per host"""
+    return aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=per_host,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT
+    )
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given as seconds or an HTTP date"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_factor(fail_count: int) -> int:
+    """How many intervals to stretch a URL's checks over after repeated failures"""
+    if fail_count <= FAIL_GRACE:
+        return 1
+    return min(2 ** (fail_count - FAIL_GRACE), MAX_BACKOFF_FACTOR)
+
+def conditional_headers(validators: Optional[Dict]) -> Dict[str, str]:
+    """Build If-None-Match / If-Modified-Since headers from stored validators"""
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def extract_validators(headers) -> Dict[str, Optional[str]]:
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'content_length': headers.get('Content-Length')
+    }
+
+class HostBackoff(Exception):
+    """Raised instead of waiting when a host is backing off for longer than the caller allows"""
+
+class HostState:
+    __slots__ = ('delay', 'next_at', 'escalated_at')
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.next_at = 0.0
+        self.escalated_at = 0.0
+
+class HostPolicy:
+    """Per-host pacing with adaptive backoff.
+
+    Request starts to one host are spaced at least ``delay`` apart. The delay
+    doubles on 429/5xx, connection errors and slow responses (never below
+    what Retry-After asks for) and decays back to ``min_delay`` on success.
+
+    A request never waits longer than ``max_wait`` for its turn: callers
+    usually hold fetch or check slots, so a backing-off host fails fast with
+    HostBackoff and the per-URL fail_count stretches the next check instead.
+    """
+
+    def __init__(self, min_delay: float = MIN_HOST_DELAY, max_delay: float = MAX_HOST_DELAY):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._hosts: OrderedDict = OrderedDict()
+
+    def _state(self, host: str) -> HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(self.min_delay)
+            while len(self._hosts) > HOSTS_MAX:
+                self._hosts.popitem(last=False)
+        self._hosts.move_to_end(host)
+        return state
+
+    async def wait(self, url: str, max_wait: float = MAX_PACING_WAIT):
+        """Reserve the host's next start slot and sleep until it, or raise HostBackoff"""
+        host = urlparse(url).netloc
+        state = self._state(host)
+        now = time.monotonic()
+        delay = state.next_at - now
+        if delay > max_wait:
+            raise HostBackoff(f"{host} is backing off for {delay:.0f}s")
+        state.next_at = max(now, state.next_at) + state.delay
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, url: str, status: Optional[int] = None, elapsed: float = 0.0, wait: Optional[float] = None):
+        """Adjust the host's delay after a response; ``status`` None means the request failed"""
+        state = self._state(urlparse(url).netloc)
+        now = time.monotonic()
+        if status is None or status in BACKOFF_STATUSES or elapsed > SLOW_RESPONSE:
+            # Requests already in flight when the delay was last raised do not raise it again
+            if now - elapsed >= state.escalated_at:
+                state.delay = min(self.max_delay, max(state.delay * 2, BACKOFF_BASE))
+                state.escalated_at = now
+            state.delay = min(self.max_delay, max(state.delay, wait or 0))
+            state.next_at = max(state.next_at, now + state.delay)
+        elif state.delay > self.min_delay:
+            state.delay = state.delay / 2 if state.delay / 2 >= BACKOFF_BASE else self.min_delay
+
+    @asynccontextmanager
+    async def request(
+        self, session: aiohttp.ClientSession, method: str, url: str,
+        max_wait: float = MAX_PACING_WAIT, **kwargs
+    ):
+        """``session.request`` paced and scored by this policy"""
+        await self.wait(url, max_wait)
+        started = time.monotonic()
+        recorded = False
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                self.record(url, resp.status, time.monotonic() - started, retry_after(resp.headers.get('Retry-After')))
+                recorded = True
+                yield resp
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if not recorded:
+                self.record(url, elapsed=time.monotonic() - started)
+            raise
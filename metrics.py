@@ -0,0 +1,222 @@
+import sys
+import time
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# Seconds; covers a cached hit up to a slow multi-file upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PROFILE_INTERVAL = 0.01  # seconds between stack samples
+PROFILE_DEPTH = 3  # frames kept per sample, innermost first
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _format_labels(key: Tuple) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in key) + '}'
+
+class Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Tuple, float]]:
+        """(name suffix, label key, value) for every series"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(key)} {value:g}")
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [('', key, value) for key, value in self.values.items()]
+
+class Gauge(Metric):
+    """A value that is set directly, or read from ``func`` at collection time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, func: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self.func = func
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def get(self) -> float:
+        return self.func() if self.func else self.value
+
+    def samples(self):
+        return [('', (), self.get())]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple, List] = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self.series.get(_label_key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bucket bound holding the q-th observation; coarse, but enough for /stats"""
+        series = self.series.get(_label_key(labels))
+        if not series:
+            return None
+        target = q * sum(series[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        samples = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                samples.append(('_bucket', key + (('le', le),), cumulative))
+            samples.append(('_sum', key, series[-1]))
+            samples.append(('_count', key, cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, func: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help_text, func))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+async def serve(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> web.AppRunner:
+    """Expose ``registry`` at http://host:port/metrics; returns the runner to clean up"""
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread.
+
+    Cheap enough to leave on for a few minutes under real load; ``report``
+    lists the innermost call chains seen most often.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, depth: int = PROFILE_DEPTH):
+        self.interval = interval
+        self.depth = depth
+        self.samples: Tally = Tally()
+        self.total = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: Optional[int] = None):
+        if self.running:
+            return
+        target = thread_id or threading.get_ident()
+        self.samples.clear()
+        self.total = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, target: int):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(stack)] += 1
+                self.total += 1
+
+    def report(self, limit: int = 10) -> str:
+        if not self.total:
+            return "No samples"
+        return '\n'.join(
+            f"{count * 100 / self.total:5.1f}% {' <- '.join(stack)}"
+            for stack, count in self.samples.most_common(limit)
+        )